@@ -3,6 +3,7 @@ from oci.config import from_file
 import json
 import sys
 import pandas as pd
+import numpy as np
 import io
 import os
 import pyarrow.parquet as pq
@@ -13,13 +14,11 @@ import tempfile
 import datetime
 import time
 
-import re
-import string
-import nltk
-from nltk.corpus import stopwords
-from transformers import BertTokenizer, TFBertModel
-import tensorflow as tf
-nltk.download('stopwords')
+from embedding_cache import EmbeddingCache
+from embeddings import embedding_columns, get_encoder
+from labels import target_labels
+from news_windows import NewsWindows
+from text_normalize import normalize_series
 
 
 
@@ -51,45 +50,18 @@ class OS_Data_Store:
             start = list_objects_response.data.next_start_with
         return objects
     
-def create_content(t,df_news,news_hour_befor=24):
-    pt=news_hour_befor*60*60*1000
-    # Convert embeddings to a numpy array
-    mean_embeddings = df_news[(df_news['TIMESTAMP']<t) & (df_news['TIMESTAMP']>t-pt)].mean()[1:]
-    return mean_embeddings     
-
-def target(t,df_features,avg_rate_hour_after=24,hold_percent=2):
-    ft=avg_rate_hour_after*60*60*1000
-    rate=df_features[df_features['TIMESTAMP']==t]['RATE'].values[0]
-    mean=df_features[(df_features['TIMESTAMP']<t+ft)&(df_features['TIMESTAMP']>t)]['RATE'].mean()
-    change=100*(mean-rate)/(rate + 1e-6)
-    return "BUY" if change > hold_percent else "SELL" if change < - hold_percent else "HOLD"
-
-def get_embeddings(text):
-    # Load the BERT tokenizer and model
-    tokenizer = BertTokenizer.from_pretrained('bert-base-cased')
-    model = TFBertModel.from_pretrained('bert-base-cased')
-    #clean the text data
-    text = text.lower() # convert text to lowercase
-    text = re.sub(r'\d+', '', text) # remove digits
-    text = text.translate(str.maketrans('', '', string.punctuation)) # remove punctuation
-    text = ' '.join([word for word in text.split() if word not in stopwords.words('english')]) # remove stop words
-    
-    # Tokenize the text data using the BERT tokenizer
-    tokens = tokenizer.encode_plus(
-        text,
-        max_length=512,
-        truncation=True,
-        padding='max_length',
-        add_special_tokens=True,
-        return_attention_mask=True,
-        return_token_type_ids=False,
-        return_tensors='tf'
-    )
-    
-    # Define a function to extract the BERT embeddings from the model
-    embeddings = model(tokens)[1][0]
-    
-    return embeddings.numpy()
+def feature_columns(df_features):
+    # FEATURES column order: crypto columns, EMBD1..EMBD768, TARGET
+    return [col for col in df_features.columns if col != 'TARGET']+embedding_columns()+['TARGET']
+
+def feature_rows(df_features,mean_embeddings,chunk_rows=1000):
+    # insert rows in feature_columns order, built a chunk at a time from the float32 embedding array
+    crypto=df_features.drop(columns='TARGET')
+    for start in range(0,len(df_features),chunk_rows):
+        stop=start+chunk_rows
+        yield [c+e+[t] for c,e,t in zip(crypto.iloc[start:stop].astype(object).values.tolist(),
+                                        mean_embeddings[df_features.index.values[start:stop]].tolist(),
+                                        df_features['TARGET'].iloc[start:stop].tolist())]
 
 def main():
     
@@ -136,13 +108,15 @@ def main():
     # we need to substitute the last 24hours of feature data with updated data as well. The reason is that the target is for the next 24       
     # 24 hr * 60 min / 5min 
     #we need data from the last 48 hours, to update data from the last 24 hours
+    # the news window of the oldest updated row reaches news_hour_befor hours further back
+    news_hour_befor=adw_env.get('news_hour_befor',24)
 
     sql_query_crypto = f"SELECT * FROM CRYPTO WHERE TIMESTAMP >= {last_time-48*60*60*1000}"
 
     sql_query_news = f"""
             SELECT *
             FROM NEWS
-            WHERE PUBDATE >= TO_DATE('1970-01-01', 'YYYY-MM-DD') + NUMTODSINTERVAL({last_time/1000-48*60*60}, 'SECOND')"""
+            WHERE PUBDATE >= TO_DATE('1970-01-01', 'YYYY-MM-DD') + NUMTODSINTERVAL({last_time/1000-(24+news_hour_befor)*60*60}, 'SECOND')"""
 
     with pool.acquire() as connection_adw:
         with connection_adw.cursor() as cursor:
@@ -160,26 +134,43 @@ def main():
     ## df_news
     df_news['TIMESTAMP']=df_news['PUBDATE'].apply(lambda x: 1000*int(time.mktime(datetime.datetime.strptime(str(x), '%Y-%m-%d %H:%M:%S').timetuple())))
     df_news['CONTENTS']=df_news['DESCRIPTION'].astype(str).fillna('')+df_news['CONTENT'].astype(str).fillna('')
-    df_news['EMBEDDINGS']=df_news['CONTENTS'].apply(get_embeddings)
-    # convert NumPy arrays to lists of their elements
-    df_news['EMBEDDINGS'] =df_news['EMBEDDINGS'].apply(lambda x: list(x))
-    # create new DataFrame with 768 columns
-    df_temp = pd.DataFrame(df_news['EMBEDDINGS'].apply(pd.Series))
-    # rename columns
-    df_temp.columns = [f'EMBD{i+1}' for i in range(768)]
-    df_news = pd.merge(df_news,df_temp, left_index=True, right_index=True)
-    
-    remove_feats=['DESCRIPTION', 'CONTENT','CONTENTS' ,'PUBDATE', 'TITLE','LINK', 'KEYWORDS', 'CREATOR', 'VIDEO_URL', 'IMAGE_URL', 'SOURCE_ID', 'CATEGORY', 'COUNTRY', 'LANGUAGE','EMBEDDINGS']
+    # the BERT model is loaded once and reused for every article; texts are encoded in length-sorted batches
+    encoder=get_encoder(adw_env.get('model_cache_dir'),adw_env.get('embedding_batch_size',32))
+    # articles already encoded by an earlier run come from the embedding cache
+    cache=EmbeddingCache(OSDS,adw_env.get('ND_ingest_path'),adw_env.get('model_cache_dir'),encoder.model_id,
+                         adw_env.get('embedding_cache_days',7))
+    cache.read()
+    # lowercase, no digits, no punctuation, no stopwords
+    cleaned=normalize_series(df_news['CONTENTS'],adw_env.get('normalize_workers',1),cache_dir=adw_env.get('model_cache_dir'))
+    # one float32 array (articles, 768), row i belonging to the i-th row of df_news
+    embeddings=cache.encode(encoder,cleaned.tolist())
+    encoder.report("ADW_Feature_Extraction")
+    try:
+        cache.save()
+    except Exception as e:
+        # a lost cache only means encoding again next run
+        print("EmbeddingCache: save failed:", e)
+    
+    remove_feats=['DESCRIPTION', 'CONTENT','CONTENTS' ,'PUBDATE', 'TITLE','LINK', 'KEYWORDS', 'CREATOR', 'VIDEO_URL', 'IMAGE_URL', 'SOURCE_ID', 'CATEGORY', 'COUNTRY', 'LANGUAGE']
     df_news=df_news.drop(remove_feats,axis=1)
     
     ## df_features
-    df_features=df_crypto.copy()
-    df_mean_embeddings=df_features['TIMESTAMP'].apply(lambda x: create_content(x,df_news,news_hour_befor=24))
-    df_features = pd.merge(df_features,df_mean_embeddings, left_index=True, right_index=True)
+    df_features=df_crypto.reset_index(drop=True)
+    # mean news embedding of the news_hour_befor hours before each crypto timestamp; kept as a float32
+    # array next to df_features (row i for index i) and only expanded to EMBD columns when written
+    windows=NewsWindows(df_news['TIMESTAMP'].values,embeddings)
+    mean_embeddings=windows.mean(df_features['TIMESTAMP'].values,news_hour_befor)
     
     ## target
-    df_features['TARGET']=df_features['TIMESTAMP'].apply(lambda x: target(x,df_features,avg_rate_hour_after=24,hold_percent=0.5))
-    df_features=df_features.dropna()
+    # the stored target is (24 h, 0.5 %); adw_env["compare_targets"], e.g. [[6, 0.5], [24, 2]], prints the
+    # label counts of other definitions, computed in the same pass
+    configs=[(24,0.5)]+[tuple(c) for c in adw_env.get('compare_targets',[])]
+    targets=target_labels(df_features['TIMESTAMP'].values,df_features['RATE'].values,configs)
+    for config in configs[1:]:
+        print("target {}h/{}%:".format(*config),pd.Series(targets[config]).value_counts().to_dict())
+    df_features['TARGET']=targets[(24,0.5)]
+    # no news in the window (NaN embedding) or a missing value: the row is dropped
+    df_features=df_features[~np.isnan(mean_embeddings[:,0])].dropna()
     
     # discarding the first 24 hours (we got 48)
     df_features=df_features[df_features['TIMESTAMP']>=last_time-24*60*60*1000]
@@ -195,23 +186,24 @@ def main():
     sql_delete_query = f"""DELETE FROM FEATURES 
             WHERE TIMESTAMP BETWEEN {min_date} AND {max_date}"""
     
+    columns=feature_columns(df_features)
     sql_insert_query = f"""
-        INSERT INTO FEATURES ({', '.join(df_features.columns)})
-        VALUES ({', '.join([':' + str(i+1) for i in range(len(df_features.columns))])})"""
+        INSERT INTO FEATURES ({', '.join(columns)})
+        VALUES ({', '.join([':' + str(i+1) for i in range(len(columns))])})"""
 
     # create the merge statement
     sql_merge_query = f"""
         MERGE INTO FEATURES f
         USING (
-            SELECT {', '.join(df_features.columns)}
+            SELECT {', '.join(columns)}
             FROM (
-                VALUES ({', '.join([':' + str(i+1) for i in range(len(df_features.columns))])})
-            ) AS new_data ({', '.join(df_features.columns)})
+                VALUES ({', '.join([':' + str(i+1) for i in range(len(columns))])})
+            ) AS new_data ({', '.join(columns)})
         ) AS nd ON f.TIMESTAMP = nd.TIMESTAMP
         WHEN MATCHED THEN
-            UPDATE SET {', '.join([f"{col}=nd.{col}" for col in df_features.columns if col != 'TIMESTAMP'])}
+            UPDATE SET {', '.join([f"{col}=nd.{col}" for col in columns if col != 'TIMESTAMP'])}
         WHEN NOT MATCHED THEN
-            INSERT ({', '.join(df_features.columns)}) VALUES ({', '.join([':' + str(i+1) for i in range(len(df_features.columns))])})
+            INSERT ({', '.join(columns)}) VALUES ({', '.join([':' + str(i+1) for i in range(len(columns))])})
     """
     
     with pool.acquire() as connection_adw:
@@ -220,7 +212,8 @@ def main():
                 # delete old dated data
                 cursor.execute(sql_delete_query)
                 # insert  the data into the table
-                cursor.executemany(sql_insert_query, df_features.values.tolist())
+                for rows in feature_rows(df_features,mean_embeddings):
+                    cursor.executemany(sql_insert_query, rows)
 
                 # commit the changes
                 connection_adw.commit()
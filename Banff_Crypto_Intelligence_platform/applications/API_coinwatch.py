@@ -2,13 +2,16 @@ import oci
 from oci.config import from_file 
 import datetime
 import time
-import requests
 import json
 import sys
-import pandas as pd
-import pyarrow.parquet as pq
-import pyarrow as pa
-import io
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import BudgetSpent, RequestBudget, TokenBucket, get_client
+from watermark import Watermark
+from parquet_io import parquet_settings, records_to_table, upload_table
+from partitions import object_path
+from schemas import CW_SCHEMA
 
 
 def time_stamp(x):
@@ -20,27 +23,51 @@ def time_stamp(x):
 
 
 class CoinWatch:
-    def __init__(self,CoinWatch_env):
+    def __init__(self,CoinWatch_env,limiter=None,budget=None):
         self.url='https://api.livecoinwatch.com/coins/single/history'
         self.currency=CoinWatch_env["currency"]
         self.code=CoinWatch_env["code"]
         self.key=CoinWatch_env["api_key_coinwatch"]
+        self.limiter=limiter
+        self.budget=budget
+        self.client=get_client(CoinWatch_env.get("http_client"))
+
+    def before_attempt(self):
+        # every attempt costs a credit: it is taken from the run's budget, then paced by the limiter
+        if self.budget is not None and not self.budget.take():
+            raise BudgetSpent("request budget of the run spent")
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    def post(self,start,end):
+        data = json.dumps({"currency":self.currency,"code":self.code,"start":start*1000,"end":end*1000,"meta":False})
+        headers = {'content-type': 'application/json','x-api-key': self.key}
+        # the history POST is a read: 429s and 5xx are retried by the client, honouring Retry-After,
+        # and every attempt takes a credit and a token
+        return self.client.post_json(self.url, idempotent=True, before_attempt=self.before_attempt,
+                                     data=data, headers=headers)
+
     def make_request(self,interval_timestamp):
         
         self.TimeStampOfIngestion         = iso8601_to_timestamp()
         self.TimeStampOfEarliestCreatedAt = iso8601_to_timestamp(interval_timestamp[0])
         self.TimeStampOfLatestCreatedAt   = iso8601_to_timestamp(interval_timestamp[1])
         
-        data = json.dumps({"currency":self.currency,"code":self.code,"start":self.TimeStampOfEarliestCreatedAt*1000,"end":self.TimeStampOfLatestCreatedAt*1000,"meta":False})
-        headers = {'content-type': 'application/json','x-api-key': self.key}
-        r = requests.post(self.url, data=data, headers=headers)
-
-        return r.json()
+        return self.post(self.TimeStampOfEarliestCreatedAt,self.TimeStampOfLatestCreatedAt)
     
     def make_file_name(self):
         filename=f"rc{self.TimeStampOfIngestion}_{self.TimeStampOfEarliestCreatedAt}_{self.TimeStampOfLatestCreatedAt}.parquet"
         return filename
 
+    def fetch(self,interval_timestamp):
+        # same as make_request + make_file_name, but keeps no state on self so it can run in worker threads
+        ingestion = iso8601_to_timestamp()
+        earliest  = iso8601_to_timestamp(interval_timestamp[0])
+        latest    = iso8601_to_timestamp(interval_timestamp[1])
+        started   = time.monotonic()
+        data      = self.post(earliest,latest)
+        return data, f"rc{ingestion}_{earliest}_{latest}.parquet", time.monotonic()-started
+
 
 class OS_Data_Store:
     def __init__(self,env):
@@ -50,10 +77,15 @@ class OS_Data_Store:
         self.compartment_id = env["compartment_id"]
         self.bucket_name    = env["bucket_name"]
         
-    def create_object(self, object_body, path):
-        response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body) 
+    def create_object(self, object_body, path, **kwargs):
+        response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body,**kwargs) 
         return response    
     
+    def upload_stream(self, stream, path, part_size):
+        upload_manager=oci.object_storage.UploadManager(self.object_storage_client,allow_parallel_uploads=True)
+        response=upload_manager.upload_stream(self.namespace_name,self.bucket_name,path,stream,part_size=part_size)
+        return response
+
     def get_object(self,path):
         response= self.object_storage_client.get_object(namespace_name=self.namespace_name,bucket_name= self.bucket_name,object_name=path)
         return response
@@ -110,6 +142,68 @@ def iso_8601_dates(from_date, to_date, interval_hour=8):
     return interval_list
 
 
+def upload_interval(OSDS,CW_data,CW_filename,ingest_path,settings):
+    #write into parquet
+    table = records_to_table(CW_data['history'],CW_SCHEMA)
+    size = upload_table(OSDS,table,object_path(ingest_path,CW_filename),settings)
+    return table.num_rows, size
+
+
+def fetch_and_upload(CW,OSDS,intervals,ingest_path,workers=4,watermark=None,settings=None):
+    # Fetch up to `workers` intervals ahead of the writer. Futures are consumed in submission
+    # order, so objects are still written in interval order. The first interval that fails stops the
+    # run: the watermark only moves over intervals that all succeeded, and the next run starts there.
+    stats=collections.Counter()
+    started=time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending=collections.deque()
+        remaining=iter(intervals)
+        for inter in remaining:
+            pending.append(executor.submit(CW.fetch,inter))
+            if len(pending)>=workers:
+                break
+        while pending:
+            future=pending.popleft()
+            nxt=next(remaining,None)
+            if nxt is not None:
+                pending.append(executor.submit(CW.fetch,nxt))
+            try:
+                CW_data,CW_filename,fetch_seconds=future.result()
+                stats['intervals']+=1
+                stats['fetch_seconds']+=fetch_seconds
+                upload_started=time.monotonic()
+                rows,size=upload_interval(OSDS,CW_data,CW_filename,ingest_path,settings)
+                stats['upload_seconds']+=time.monotonic()-upload_started
+                stats['rows']+=rows
+                stats['bytes']+=size
+                if watermark is not None and rows:
+                    watermark.advance(object_path(ingest_path,CW_filename),CW_data['history'][-1]['date'])
+            except Exception as e:
+                if isinstance(e,BudgetSpent):
+                    print("API_COINWATCH: request budget spent")
+                else:
+                    stats['errors']+=1
+                    print("API_COINWATCH: Error during write into parquet:", e)
+                # intervals already fetched ahead are dropped, not written past the failed one
+                for future in pending:
+                    future.cancel()
+                print("API_COINWATCH: stopping, {} interval(s) left for the next run".format(len(pending)+sum(1 for _ in remaining)+1))
+                break
+    stats['wall_seconds']=time.monotonic()-started
+    return stats
+
+
+def print_throughput(stats):
+    wall=max(stats['wall_seconds'],1e-9)
+    print("API_COINWATCH: {} intervals, {} rows, {} errors in {:.1f}s".format(
+        stats['intervals'],stats['rows'],stats['errors'],stats['wall_seconds']))
+    print("API_COINWATCH: fetch {:.2f} intervals/s (mean latency {:.2f}s), upload {:.1f} rows/s ({:.1f} KiB/s)".format(
+        stats['intervals']/wall,
+        stats['fetch_seconds']/max(stats['intervals'],1),
+        stats['rows']/max(stats['upload_seconds'],1e-9),
+        stats['bytes']/1024/max(stats['upload_seconds'],1e-9)))
+
+
 def main():
     
     env_str = sys.argv[1]
@@ -120,29 +214,31 @@ def main():
     
 
     OSDS=OS_Data_Store(env)
-    list_objects_response=OSDS.list_object(CoinWatch_env['CW_ingest_path'])
+    watermark=Watermark(OSDS,CoinWatch_env['CW_ingest_path'],'date',CoinWatch_env.get('CW_manifest_path'))
+    # API_coinwatch.py <env> <CoinWatch_env> rebuild-watermark : recreate the manifest from the bucket listing
+    if sys.argv[3:4]==['rebuild-watermark']:
+        print("API_COINWATCH: watermark rebuilt:", watermark.rebuild())
+        return
 
-    get_object_response = OSDS.get_object(list_objects_response[-1].name)
-    parquet_table = pq.read_table(io.BytesIO(get_object_response.data.content))
-    last_timestamp=parquet_table['date'][-1].as_py()
+    last_timestamp=watermark.last_timestamp()
 
     intervals=iso_8601_dates(timestamp_to_iso8601(last_timestamp),timestamp_to_iso8601(),CoinWatch_env["interval_hour"])
 
     if intervals:
-        CW=CoinWatch(CoinWatch_env)
-        for inter in intervals:
-            CW_data=CW.make_request(inter)
-            CW_filename=CW.make_file_name()
-            #write into parquet
-            try:
-                #df=pd.DataFrame(CW_data['history'], index=None)
-                df = pd.DataFrame(CW_data['history'], index=range(len(CW_data['history'])))
-                df.to_parquet(CW_filename)
-                with open(CW_filename, 'rb') as f:
-                    OSDS.create_object(f,'{}/{}'.format(CoinWatch_env["CW_ingest_path"],CW_filename))
+        # Livecoinwatch free tier: 10,000 credits a day (daily_credits), one per request. The sustained rate
+        # defaults to the credits spread over the day (about 7 a minute), with bursts of rate_limit_burst, and
+        # a run makes at most daily_credits/runs_per_day requests (runs_per_day: how often the job is
+        # scheduled, default hourly), so a long catch-up spreads over the day's runs instead of spending the
+        # day's credits and failing on 429s; the watermark keeps the intervals left for the next run
+        daily_credits=CoinWatch_env.get("daily_credits",10000)
+        limiter=TokenBucket(CoinWatch_env.get("rate_limit_per_minute",daily_credits/(24*60))/60,
+                            CoinWatch_env.get("rate_limit_burst",10))
+        budget=RequestBudget(CoinWatch_env.get("max_requests_per_run",daily_credits//CoinWatch_env.get("runs_per_day",24)))
+        CW=CoinWatch(CoinWatch_env,limiter,budget)
+        stats=fetch_and_upload(CW,OSDS,intervals,CoinWatch_env["CW_ingest_path"],CoinWatch_env.get("fetch_workers",4),watermark,
+                             parquet_settings(CoinWatch_env))
+        print_throughput(stats)
+        print("API_COINWATCH: {} API requests used".format(budget.used))
 
-            except Exception as e:
-                print("API_COINWATCH: Error during write into parquet:", e)
-                    
 if __name__=="__main__": 
     main()
\ No newline at end of file
@@ -2,10 +2,14 @@ import oci
 from oci.config import from_file 
 import datetime
 import time
-import requests
 import json
 import sys
-import pandas as pd
+
+from http_client import TokenBucket, get_client
+from backfill import AdaptiveWindow, run_backfill
+from parquet_io import parquet_settings, records_to_table, upload_table
+from partitions import object_path
+from schemas import CW_SCHEMA
 
 
 def time_stamp(x):
@@ -17,11 +21,13 @@ def time_stamp(x):
 
 
 class CoinWatch:
-    def __init__(self,CoinWatch_env):
+    def __init__(self,CoinWatch_env,limiter=None):
         self.url='https://api.livecoinwatch.com/coins/single/history'
         self.currency=CoinWatch_env["currency"]
         self.code=CoinWatch_env["code"]
         self.key=CoinWatch_env["api_key_coinwatch"]
+        self.limiter=limiter
+        self.client=get_client(CoinWatch_env.get("http_client"))
     def make_request(self,interval_timestamp):
         
         self.TimeStampOfIngestion         = iso8601_to_timestamp()
@@ -30,9 +36,10 @@ class CoinWatch:
         
         data = json.dumps({"currency":self.currency,"code":self.code,"start":self.TimeStampOfEarliestCreatedAt*1000,"end":self.TimeStampOfLatestCreatedAt*1000,"meta":False})
         headers = {'content-type': 'application/json','x-api-key': self.key}
-        r = requests.post(self.url, data=data, headers=headers)
-
-        return r.json()
+        # retried by the client as an idempotent read; every attempt takes a token
+        return self.client.post_json(self.url, idempotent=True,
+                                     before_attempt=self.limiter.acquire if self.limiter is not None else None,
+                                     data=data, headers=headers)
     
     def make_file_name(self):
         filename=f"rc{self.TimeStampOfIngestion}_{self.TimeStampOfEarliestCreatedAt}_{self.TimeStampOfLatestCreatedAt}.parquet"
@@ -51,10 +58,27 @@ class OS_Data_Store:
         response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body) 
         return response    
     
+    def upload_stream(self, stream, path, part_size):
+        upload_manager=oci.object_storage.UploadManager(self.object_storage_client,allow_parallel_uploads=True)
+        response=upload_manager.upload_stream(self.namespace_name,self.bucket_name,path,stream,part_size=part_size)
+        return response
+
     def get_object(self,path):
         response= self.object_storage_client.get_object(namespace_name=self.namespace_name,bucket_name= self.bucket_name,object_name=path)
         return response
     
+    def list_object(self,prefix):
+        objects = []
+        start=None
+        while True:
+            list_objects_response = self.object_storage_client.list_objects(namespace_name=self.namespace_name, 
+                                                                        bucket_name=self.bucket_name,prefix=prefix,start=start)
+            objects += list_objects_response.data.objects
+            if not list_objects_response.data.next_start_with:
+                break
+            start = list_objects_response.data.next_start_with
+        return objects
+    
 def iso8601_to_timestamp(date_string=None):
     if date_string is None:
         date_time_obj = datetime.datetime.now()
@@ -81,6 +105,32 @@ def iso_8601_dates(from_date, to_date, interval_hour=8):
     return interval_list
 
 
+def run_shard(env, CoinWatch_env, shard):
+    # runs in a backfill worker process
+    processes=CoinWatch_env.get("backfill_processes",4)
+    # the daily credits spread over the day (Livecoinwatch free tier: 10,000), shared by the processes
+    rate_limit_per_minute=CoinWatch_env.get("rate_limit_per_minute",CoinWatch_env.get("daily_credits",10000)/(24*60))
+    limiter=TokenBucket(rate_limit_per_minute/60/processes,1)
+    CW=CoinWatch(CoinWatch_env,limiter)
+    OSDS=OS_Data_Store(env)
+    settings=parquet_settings(CoinWatch_env)
+
+    def fetch(start,end):
+        return CW.make_request((datetime.datetime.fromtimestamp(start).isoformat(),datetime.datetime.fromtimestamp(end).isoformat()))
+
+    window=AdaptiveWindow(CoinWatch_env["interval_hour"],CoinWatch_env.get("max_points",1000),
+                          CoinWatch_env.get("min_interval_hour",0.25),CoinWatch_env.get("max_interval_hour",24*7))
+    stats={'windows':0,'rows':0}
+    for start,end,CW_data in window.walk(shard[0],shard[1],fetch,lambda data: len(data['history'])):
+        CW_filename=CW.make_file_name()
+        #write into parquet
+        table=records_to_table(CW_data['history'],CW_SCHEMA)
+        upload_table(OSDS,table,object_path(CoinWatch_env["CW_ingest_path"],CW_filename),settings)
+        stats['windows']+=1
+        stats['rows']+=table.num_rows
+    return stats
+
+
 def main():
     
     env_str = sys.argv[1]
@@ -89,18 +139,12 @@ def main():
     env = json.loads(env_str)
     CoinWatch_env = json.loads(CoinWatch_env_str)
     
-    intervals=iso_8601_dates(CoinWatch_env["from_date"],CoinWatch_env["to_date"],CoinWatch_env["interval_hour"])
-    
-    CW=CoinWatch(CoinWatch_env)
     OSDS=OS_Data_Store(env)
-    for inter in intervals:
-        CW_data=CW.make_request(inter)
-        CW_filename=CW.make_file_name()
-        #write into parquet
-        df=pd.DataFrame(CW_data['history'], index=None)
-        df.to_parquet(CW_filename)
-        with open(CW_filename, 'rb') as f:
-            OSDS.create_object(f,'{}/{}'.format(CoinWatch_env["CW_ingest_path"],CW_filename))
+    failed=run_backfill(OSDS,CoinWatch_env["CW_ingest_path"],
+                        iso8601_to_timestamp(CoinWatch_env["from_date"]),iso8601_to_timestamp(CoinWatch_env["to_date"]),
+                        run_shard,(env,CoinWatch_env),CoinWatch_env,"API_COINWATCH_HISTORY")
+    if failed:
+        sys.exit(1)
         
 if __name__=="__main__": 
     main()
\ No newline at end of file
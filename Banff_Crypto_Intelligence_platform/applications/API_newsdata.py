@@ -2,14 +2,17 @@ import oci
 from oci.config import from_file 
 import datetime
 import time
-import requests
 import json
 import sys
-import pandas as pd
-import tempfile
-import pyarrow.parquet as pq
 import pyarrow as pa
-import io
+import pyarrow.compute as pc
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import RequestBudget, get_client
+from watermark import Watermark
+from parquet_io import parquet_settings, upload_table
+from partitions import object_path
+from schemas import ND_SCHEMA, build_table
 
 def iso8601_to_timestamp(date_string=None):
     if date_string is None:
@@ -48,18 +51,41 @@ class NewsData:
         self.country=NewsData_env["country"]
         self.language=NewsData_env["language"]
         self.q=NewsData_env["q"]
+        self.client=get_client(NewsData_env.get("http_client"))
+        self.prefetch=ThreadPoolExecutor(max_workers=1)
 
 
-    def make_request(self,interval):
+    def make_request(self,interval,page=None):
         self.url=f"https://newsdata.io/api/1/archive?apikey={self.key}&country={self.country}&language={self.language}&q={self.q}&from_date={interval[0]}&to_date={interval[1]}"
-        response = requests.get(self.url)
-        
-        data=response.json()
+        if page:
+            self.url+=f"&page={page}"
+        data=self.client.get_json(self.url)
     
         self.TimeStampOfIngestion         = iso8601_to_timestamp()
         self.TimeStampOfLatestCreatedAt   = iso8601_to_timestamp(interval[1])
         self.TimeStampOfEarliestCreatedAt = iso8601_to_timestamp(interval[0])
         return data
+
+    def fetch_interval(self,interval,budget):
+        # Follows nextPage until the archive is exhausted or the run's request budget is spent.
+        # The request for page k+1 is in flight while page k is converted to Arrow.
+        # The caller has already taken the budget for the first page.
+        tables=[]
+        pages=0
+        future=self.prefetch.submit(self.make_request,interval)
+        while future is not None:
+            data=future.result()
+            pages+=1
+            next_page=data.get('nextPage')
+            future=None
+            if next_page and budget.take():
+                future=self.prefetch.submit(self.make_request,interval,next_page)
+            tables.append(build_table(data['results'],ND_SCHEMA))
+        table=pa.concat_tables(tables)
+        metadata=dict(ND_SCHEMA.metadata)
+        metadata.update({b'pages':str(pages).encode(),b'articles':str(table.num_rows).encode(),
+                         b'truncated':str(bool(next_page)).lower().encode()})
+        return table.replace_schema_metadata(metadata), pages, bool(next_page)
     
     def make_file_name(self):
         filename="rn{}_{}_{}.parquet".format(self.TimeStampOfIngestion,self.TimeStampOfEarliestCreatedAt,self.TimeStampOfLatestCreatedAt)
@@ -74,10 +100,15 @@ class OS_Data_Store:
         self.compartment_id = env["compartment_id"]
         self.bucket_name    = env["bucket_name"]
         
-    def create_object(self, object_body, path):
-        response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body) 
+    def create_object(self, object_body, path, **kwargs):
+        response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body,**kwargs) 
         return response    
     
+    def upload_stream(self, stream, path, part_size):
+        upload_manager=oci.object_storage.UploadManager(self.object_storage_client,allow_parallel_uploads=True)
+        response=upload_manager.upload_stream(self.namespace_name,self.bucket_name,path,stream,part_size=part_size)
+        return response
+
     def get_object(self,path):
         response= self.object_storage_client.get_object(namespace_name=self.namespace_name,bucket_name= self.bucket_name,object_name=path)
         return response
@@ -103,12 +134,13 @@ def main():
     NewsData_env = json.loads(NewsData_env_str)
 
     OSDS=OS_Data_Store(env)
+    watermark=Watermark(OSDS,NewsData_env['ND_ingest_path'],'pubDate',NewsData_env.get('ND_manifest_path'))
+    # API_newsdata.py <env> <NewsData_env> rebuild-watermark : recreate the manifest from the bucket listing
+    if sys.argv[3:4]==['rebuild-watermark']:
+        print("API_newsdata: watermark rebuilt:", watermark.rebuild())
+        return
 
-    list_objects_response=OSDS.list_object(NewsData_env['ND_ingest_path'])
-
-    get_object_response = OSDS.get_object(list_objects_response[-1].name)
-    parquet_table = pq.read_table(io.BytesIO(get_object_response.data.content))
-    last_timestamp=parquet_table['pubDate'][-1].as_py()        
+    last_timestamp=watermark.last_timestamp()
     now=datetime.datetime.now().isoformat()    
 
     intervals=iso_8601_dates(last_timestamp,now,NewsData_env["interval_hour"])
@@ -116,20 +148,33 @@ def main():
 
     if intervals:
         ND=NewsData(NewsData_env)
+        settings=parquet_settings(NewsData_env)
+        budget=RequestBudget(NewsData_env.get("max_requests_per_run",200))
         for inter in intervals:
-            ND_data=ND.make_request(inter)
-            ND_filename=ND.make_file_name()
-
+            if not budget.take():
+                # the watermark has not moved past this interval, the next run picks it up
+                print("API_newsdata: request budget spent, stopping before", inter[0])
+                break
             #write into parquet
             try:
-                
-                df = pd.DataFrame(ND_data['results'], index=range(len(ND_data['results'])))
-                
-                df.to_parquet(ND_filename)
-                with open(ND_filename, 'rb') as f:
-                    OSDS.create_object(f,'{}/{}'.format(NewsData_env["ND_ingest_path"],ND_filename))
+                table,pages,truncated=ND.fetch_interval(inter,budget)
+                ND_filename=ND.make_file_name()
+
+                upload_table(OSDS,table,object_path(NewsData_env["ND_ingest_path"],ND_filename),settings)
+                if truncated:
+                    # the pages fetched are kept (the loads drop the rows fetched again), but the watermark
+                    # stays before this interval so the next run fetches all of it, then the later ones
+                    print("API_newsdata: {} truncated after {} pages ({} articles), interval left for the next run".format(
+                        ND_filename,pages,table.num_rows))
+                    break
+                if table.num_rows:
+                    # results come newest first: the latest article is the max pubDate, not the last row
+                    watermark.advance(object_path(NewsData_env["ND_ingest_path"],ND_filename),pc.max(table['pubDate']).as_py())
             except Exception as e:
+                # the watermark stays before this interval, so the next run fetches it again, then the later ones
                 print("API_newsdata: Error during write into parquet:", e)
+                break
+        print("API_newsdata: {} API requests used".format(budget.used))
                     
 
 if __name__=="__main__":
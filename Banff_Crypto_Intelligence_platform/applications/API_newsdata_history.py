@@ -2,10 +2,16 @@ import oci
 from oci.config import from_file 
 import datetime
 import time
-import requests
 import json
 import sys
-import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import RequestBudget, get_client
+from backfill import AdaptiveWindow, run_backfill
+from parquet_io import parquet_settings, upload_table
+from partitions import object_path
+from schemas import ND_SCHEMA, build_table
 
 def iso8601_to_timestamp(date_string=None):
     if date_string is None:
@@ -38,18 +44,41 @@ class NewsData:
         self.country=NewsData_env["country"]
         self.language=NewsData_env["language"]
         self.q=NewsData_env["q"]
+        self.client=get_client(NewsData_env.get("http_client"))
+        self.prefetch=ThreadPoolExecutor(max_workers=1)
 
 
-    def make_request(self,interval):
+    def make_request(self,interval,page=None):
         self.url=f"https://newsdata.io/api/1/archive?apikey={self.key}&country={self.country}&language={self.language}&q={self.q}&from_date={interval[0]}&to_date={interval[1]}"
-        response = requests.get(self.url)
-        
-        data=response.json()
+        if page:
+            self.url+=f"&page={page}"
+        data=self.client.get_json(self.url)
     
         self.TimeStampOfIngestion         = iso8601_to_timestamp()
         self.TimeStampOfLatestCreatedAt   = iso8601_to_timestamp(interval[1])
         self.TimeStampOfEarliestCreatedAt = iso8601_to_timestamp(interval[0])
         return data
+
+    def fetch_interval(self,interval,budget):
+        # Follows nextPage until the archive is exhausted or the run's request budget is spent.
+        # The request for page k+1 is in flight while page k is converted to Arrow.
+        # The caller has already taken the budget for the first page.
+        tables=[]
+        pages=0
+        future=self.prefetch.submit(self.make_request,interval)
+        while future is not None:
+            data=future.result()
+            pages+=1
+            next_page=data.get('nextPage')
+            future=None
+            if next_page and budget.take():
+                future=self.prefetch.submit(self.make_request,interval,next_page)
+            tables.append(build_table(data['results'],ND_SCHEMA))
+        table=pa.concat_tables(tables)
+        metadata=dict(ND_SCHEMA.metadata)
+        metadata.update({b'pages':str(pages).encode(),b'articles':str(table.num_rows).encode(),
+                         b'truncated':str(bool(next_page)).lower().encode()})
+        return table.replace_schema_metadata(metadata), pages, bool(next_page)
     
     def make_file_name(self):
         filename="rn{}_{}_{}.parquet".format(self.TimeStampOfIngestion,self.TimeStampOfEarliestCreatedAt,self.TimeStampOfLatestCreatedAt)
@@ -68,11 +97,58 @@ class OS_Data_Store:
         response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body) 
         return response    
     
+    def upload_stream(self, stream, path, part_size):
+        upload_manager=oci.object_storage.UploadManager(self.object_storage_client,allow_parallel_uploads=True)
+        response=upload_manager.upload_stream(self.namespace_name,self.bucket_name,path,stream,part_size=part_size)
+        return response
+
     def get_object(self,path):
         response= self.object_storage_client.get_object(namespace_name=self.namespace_name,bucket_name= self.bucket_name,object_name=path)
         return response
     
+    def list_object(self,prefix):
+        objects = []
+        start=None
+        while True:
+            list_objects_response = self.object_storage_client.list_objects(namespace_name=self.namespace_name, 
+                                                                        bucket_name=self.bucket_name,prefix=prefix,start=start)
+            objects += list_objects_response.data.objects
+            if not list_objects_response.data.next_start_with:
+                break
+            start = list_objects_response.data.next_start_with
+        return objects
     
+    
+def run_shard(env, NewsData_env, shard):
+    # runs in a backfill worker process; errors fail the whole shard so a rerun fetches it again
+    ND=NewsData(NewsData_env)
+    OSDS=OS_Data_Store(env)
+    settings=parquet_settings(NewsData_env)
+    # per shard, i.e. per worker process
+    budget=RequestBudget(NewsData_env.get("max_requests_per_shard"))
+
+    def fetch(start,end):
+        if not budget.take():
+            raise RuntimeError("request budget spent")
+        return ND.fetch_interval((datetime.datetime.fromtimestamp(start).isoformat(),datetime.datetime.fromtimestamp(end).isoformat()),budget)
+
+    # with pagination nothing is truncated; the window size only keeps each object near max_points articles
+    window=AdaptiveWindow(NewsData_env["interval_hour"],NewsData_env.get("max_points",500),
+                          NewsData_env.get("min_interval_hour",1),NewsData_env.get("max_interval_hour",24*7),
+                          refetch_full=False)
+    stats={'windows':0,'rows':0,'pages':0}
+    for start,end,(table,pages,truncated) in window.walk(shard[0],shard[1],fetch,lambda fetched: fetched[0].num_rows):
+        if truncated:
+            raise RuntimeError("request budget spent inside a window")
+        ND_filename=ND.make_file_name()
+        #write into parquet
+        upload_table(OSDS,table,object_path(NewsData_env["ND_ingest_path"],ND_filename),settings)
+        stats['windows']+=1
+        stats['rows']+=table.num_rows
+        stats['pages']+=pages
+    return stats
+
+
 def main():
     
     env_str = sys.argv[1]
@@ -81,21 +157,12 @@ def main():
     env = json.loads(env_str)
     NewsData_env = json.loads(NewsData_env_str)
     
-    intervals=iso_8601_dates(NewsData_env["from_date"],NewsData_env["to_date"],NewsData_env["interval_hour"])
-
-
-    ND=NewsData(NewsData_env)
     OSDS=OS_Data_Store(env)
-    for inter in intervals:
-        ND_data=ND.make_request(inter)
-        ND_filename=ND.make_file_name()
-        
-        #write into parquet
-        try:
-            df=pd.DataFrame(ND_data['results'], index=None)
-            df.to_parquet(ND_filename)
-            with open(ND_filename, 'rb') as f:
-                OSDS.create_object(f,'{}/{}'.format(NewsData_env["ND_ingest_path"],ND_filename))
+    failed=run_backfill(OSDS,NewsData_env["ND_ingest_path"],
+                        iso8601_to_timestamp(NewsData_env["from_date"]),iso8601_to_timestamp(NewsData_env["to_date"]),
+                        run_shard,(env,NewsData_env),NewsData_env,"API_newsdata_history")
+    if failed:
+        sys.exit(1)
 
 
         
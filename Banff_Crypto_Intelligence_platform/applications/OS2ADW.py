@@ -2,15 +2,26 @@ import oci
 from oci.config import from_file 
 import json
 import sys
-import pandas as pd
 import io
 import os
-import pyarrow.parquet as pq
+import posixpath
 import pyarrow as pa
+import pyarrow.compute as pc
 import oracledb
-import math
+from oci.exceptions import ServiceError
 import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from compaction import live_objects, read_manifest
+from partitions import list_partitions
+from watermark import OBJECT_NAME, manifest_path
+from adw_load import (DEFAULT_CHUNK_ROWS, LoadMeter, RunSummary, create_staging_tables, key_batches, load_crypto,
+                      load_news, read_crypto, read_news)
+from object_fetch import ByteBudget, fetch_objects
+from digests import DigestIndex
+from ledger import (claim_objects, compacted_loaded, create_ledger_table, read_ledger, record_loaded, reload_prefixes,
+                    unseen_objects)
 
 class OS_Data_Store:
     def __init__(self,env):
@@ -33,7 +44,8 @@ class OS_Data_Store:
         start=None
         while True:
             list_objects_response = self.object_storage_client.list_objects(namespace_name=self.namespace_name, 
-                                                                        bucket_name=self.bucket_name,prefix=prefix,start=start)
+                                                                        bucket_name=self.bucket_name,prefix=prefix,start=start,
+                                                                        fields='name,size,etag')
             objects += list_objects_response.data.objects
             if not list_objects_response.data.next_start_with:
                 break
@@ -42,20 +54,215 @@ class OS_Data_Store:
     
 def filter_obj_list(object_list,from_date, to_date):
     l=[]
-    for i, obj in enumerate(object_list):
-        if (from_date<int(obj.name[-29:-19])) and (int(obj.name[-18:-8])<=to_date):
-            l.append(object_list[i])
+    for obj in object_list:
+        match=OBJECT_NAME.search(obj.name)
+        if match and (from_date<int(match.group(1))) and (int(match.group(2))<=to_date):
+            l.append(obj)
     return l
-def main():
-    
-    env_str = sys.argv[1]
-    adw_env_str = sys.argv[2]
-    env = json.loads(env_str)
-    adw_env = json.loads(adw_env_str)
-    
+
+# per source: where its objects are and how to read and load its rows. key is the column batches are
+# split on; prefilter drops rows already in the table before binding (digests.DigestIndex).
+SOURCES = {
+    'crypto': {'path_key': 'CW_ingest_path', 'legacy_prefix': 'rc', 'key': 'date',
+               'read': read_crypto, 'load': load_crypto},
+    'news':   {'path_key': 'ND_ingest_path', 'legacy_prefix': 'rn', 'key': 'pubDate',
+               'read': read_news, 'load': load_news, 'prefilter': True},
+}
+
+# rows carry the index of the object they came from, to tell which objects were fully loaded
+OBJECT_COLUMN = '_object'
+
+def quarantine_path(ingest_path,run_id,batch_no):
+    # data-lake/raw-data/news -> data-lake/raw-data/_quarantine/news/<run>_batch<n>.jsonl
+    ingest_path=ingest_path.rstrip('/')
+    return posixpath.join(posixpath.dirname(ingest_path),'_quarantine',posixpath.basename(ingest_path),
+                          '{}_batch{}.jsonl'.format(run_id,batch_no))
+
+def load_batch(pool,name,batch,batch_no,detail,settings,summary):
+    # every batch is loaded on its own pooled session, chunk by chunk, each chunk committed on its own
+    with summary.stage(name,'load',detail):
+        with pool.acquire() as connection_adw:
+            try:
+                chunks,rejected=SOURCES[name]['load'](connection_adw,batch,settings['load_mode'],settings['chunk_rows'])
+            except Exception as e:
+                print("Error during insert:", e)
+                connection_adw.rollback()
+                raise
+        for i,chunk in enumerate(chunks):
+            print("OS2ADW: {} batch {} chunk {}: {rows} rows, {inserted} inserted, {duplicates} duplicates, {rejected} rejected".format(
+                name,batch_no,i+1,**chunk))
+        if rejected:
+            # rejected rows are kept for inspection; the batch itself counts as loaded
+            path=quarantine_path(settings['adw_env'][SOURCES[name]['path_key']],settings['run_id'],batch_no)
+            settings['make_store']().create_object('\n'.join(json.dumps(row,default=str) for _,row in rejected),path)
+            print("OS2ADW: {} batch {}: {} rejected rows written to {}".format(name,batch_no,len(rejected),path))
+    # the rows now in the table (inserted or already there), without the rejected ones
+    keep=[True]*batch.num_rows
+    for offset,_ in rejected:
+        keep[offset]=False
+    return batch.filter(pa.array(keep)) if rejected else batch
+
+def sweep_due(OSDS,ingest_path,settings):
+    # every ledger_sweep_hours (and with --sweep) the whole ingest prefix is diffed against the ledger, so
+    # late and backfilled objects whose window is older than the lookback are loaded too
+    if settings['sweep']:
+        return True
+    if not settings['sweep_hours']:
+        return False
+    try:
+        response=OSDS.get_object(manifest_path(ingest_path,'.sweep.json'))
+    except ServiceError as e:
+        if e.status==404:
+            return True
+        raise
+    return time.time()-json.loads(response.data.content)['swept_at']>=settings['sweep_hours']*3600
+
+def record_sweep(OSDS,ingest_path,swept_at,listed):
+    OSDS.create_object(json.dumps({'swept_at':swept_at,'objects':listed}),manifest_path(ingest_path,'.sweep.json'))
+
+def run_source(name,OSDS,pool,batch_executor,settings,summary):
+    source=SOURCES[name]
+    ingest_path=settings['adw_env'][source['path_key']]
+
+    now = int(time.time())
+    from_date = now-settings['lookback_days']*24*3600
+
+    with summary.stage(name,'list'):
+        # only the year=/month=/day= partitions of the lookback window, plus the prefixes to reload, are
+        # listed; a sweep lists the whole prefix
+        sweep=sweep_due(OSDS,ingest_path,settings)
+        if sweep:
+            list_objects_response=filter_obj_list(OSDS.list_object(ingest_path.rstrip('/')+'/'),0,now)
+            print("OS2ADW: {} sweep, the whole ingest prefix is diffed against the ledger".format(name))
+        else:
+            list_objects_response=list_partitions(OSDS,ingest_path,from_date,now,legacy_prefix=source['legacy_prefix'])
+            list_objects_response=filter_obj_list(list_objects_response,from_date,now)
+        reload=[prefix for prefix in settings['reload'] if prefix.startswith(ingest_path.rstrip('/')+'/')]
+        for prefix in reload:
+            list_objects_response+=filter_obj_list(OSDS.list_object(prefix),0,now)
+        list_objects_response=list({obj.name: obj for obj in list_objects_response}.values())
+        # hide small objects already merged by the compaction job
+        compaction_manifest,_=read_manifest(OSDS,ingest_path)
+        list_objects_response=live_objects(list_objects_response,compaction_manifest)
+
+    with summary.stage(name,'ledger'):
+        #limiting the list to objects not loaded yet, or changed since
+        # the listed objects, and the objects the listed compacted ones were merged from
+        merged_from=compaction_manifest.get('merged_from',{})
+        names=[obj.name for obj in list_objects_response]
+        names+=[original for obj_name in names for original in merged_from.get(obj_name,())]
+        with pool.acquire() as connection_adw:
+            ledger=read_ledger(connection_adw,name,names)
+        listed=len(list_objects_response)
+        list_objects_response=unseen_objects(list_objects_response,ledger,reload)
+        # compacted objects made only of loaded objects are recorded as they are, not downloaded again
+        covered=compacted_loaded(list_objects_response,merged_from,ledger,reload)
+        if covered:
+            with pool.acquire() as connection_adw:
+                record_loaded(connection_adw,name,[(obj,None) for obj in covered])
+            covered_names={obj.name for obj in covered}
+            list_objects_response=[obj for obj in list_objects_response if obj.name not in covered_names]
+        print("OS2ADW: {} {} objects listed, {} compacted from loaded objects, {} new or changed".format(
+            name,listed,len(covered),len(list_objects_response)))
+
+    # the objects are claimed on a session held until the ledger is recorded; objects an OS2ADW_event
+    # run is loading right now are left to it (its ledger row tells the next run whether it succeeded)
+    with pool.acquire() as connection_claim:
+        with summary.stage(name,'claim'):
+            claimed=claim_objects(connection_claim,name,[obj.name for obj in list_objects_response])
+            if len(claimed)<len(list_objects_response):
+                print("OS2ADW: {} {} objects claimed by another run, skipped".format(
+                    name,len(list_objects_response)-len(claimed)))
+            list_objects_response=[obj for obj in list_objects_response if obj.name in claimed]
+        loaded=load_objects(name,OSDS,pool,connection_claim,batch_executor,settings,summary,list_objects_response)
+    # a sweep only counts once all it found is loaded; otherwise the next run sweeps again
+    if sweep and not [stage for stage in summary.failed() if stage[0]==name]:
+        record_sweep(OSDS,ingest_path,now,listed)
+    return loaded
+
+def load_objects(name,OSDS,pool,connection_claim,batch_executor,settings,summary,objects):
+    source=SOURCES[name]
+    ingest_path=settings['adw_env'][source['path_key']]
+    index=None
+    if source.get('prefilter'):
+        index=DigestIndex(OSDS,ingest_path,settings['adw_env'].get('persist_news_digests',False))
+    # objects are loaded while the rest still downloads: they are gathered into groups of about group_rows
+    # rows (or half the download budget) and a group is loaded while the next one fills. Groups are loaded
+    # one at a time, so no key is merged from two sessions at once, and a group's tables are dropped, and
+    # their decoded bytes given back to the download budget, as soon as its batches are done
+    budget=ByteBudget(settings['download_budget'])
+    state={'loaded':0,'batches':0,'failed':set()}
+    fetched=[]
+    group=[]
+    running=([],[])
+    with summary.stage(name,'fetch','{} objects'.format(len(objects))):
+        for obj,table in fetch_objects(settings['make_store'],objects,source['read'],
+                                       settings['download_workers'],budget=budget):
+            group.append((len(fetched),table))
+            fetched.append((obj,table.num_rows))
+            if (sum(t.num_rows for _,t in group)>=settings['group_rows']
+                    or sum(t.nbytes for _,t in group)>=budget.limit/2 or budget.full()):
+                finish_group(running,budget,index,state)
+                running=(group,load_group(name,group,index,pool,batch_executor,settings,summary,state))
+                group=[]
+        finish_group(running,budget,index,state)
+        finish_group((group,load_group(name,group,index,pool,batch_executor,settings,summary,state)),budget,index,state)
+
+    with summary.stage(name,'record_ledger'):
+        # commits on the claiming session, which releases the claims
+        record_loaded(connection_claim,name,[loaded for i,loaded in enumerate(fetched) if i not in state['failed']])
+    if index is not None and fetched:
+        try:
+            with summary.stage(name,'save_digests'):
+                index.save()
+        except Exception as e:
+            print("OS2ADW: could not save the {} digests:".format(name), e)
+    return state['loaded']
+
+def load_group(name,group,index,pool,batch_executor,settings,summary,state):
+    # group: [(object index, table)] -> [(batch, future)] of its key batches, submitted to the load workers
+    source=SOURCES[name]
+    if not group:
+        return []
+    data=pa.concat_tables([table.append_column(OBJECT_COLUMN,pa.array([i]*table.num_rows,pa.int32()))
+                           for i,table in group])
+    if index is not None and data.num_rows:
+        with summary.stage(name,'prefilter'):
+            bounds=pc.min_max(data[source['key']])
+            with pool.acquire() as connection_adw:
+                queried=index.load(connection_adw,bounds['min'].as_py(),bounds['max'].as_py())
+            total=data.num_rows
+            data,hits=index.filter(data)
+            print("OS2ADW: {} pre-filter dropped {} of {} rows ({:.1%} hit rate), {} digests, {} keys queried".format(
+                name,hits,total,hits/total,len(index.digests),queried))
+
+    # insert the data, ignoring rows already in the table; batches run concurrently and fail on their own
+    futures=[]
+    for batch in key_batches(data,source['key'],settings['batch_rows']):
+        state['batches']+=1
+        keys=batch[source['key']]
+        detail='batch {}: {} rows, {} {}..{}'.format(state['batches'],batch.num_rows,source['key'],keys[0],keys[-1])
+        futures.append((batch,batch_executor.submit(load_batch,pool,name,batch,state['batches'],detail,settings,summary)))
+    return futures
+
+def finish_group(running,budget,index,state):
+    # waits for the batches of a group, then gives its decoded bytes back to the download budget
+    group,futures=running
+    for batch,future in futures:
+        try:
+            kept=future.result()
+        except Exception:
+            # recorded in the run summary; its objects stay out of the ledger and are retried next run
+            state['failed'].update(pc.unique(batch[OBJECT_COLUMN]).to_pylist())
+            continue
+        state['loaded']+=kept.num_rows
+        # only rows that reached the table; a rejected row must not be dropped by the next run's pre-filter
+        if index is not None:
+            index.add(kept)
+    budget.release(sum(table.nbytes for _,table in group))
+
+def create_adw_pool(OSDS,adw_env):
     temp_dir = tempfile.gettempdir()
-    
-    OSDS=OS_Data_Store(env)
 
     get_object_response=OSDS.get_object(adw_env['tnsnames_dir'])
     tnsnames = io.BytesIO(get_object_response.data.content)
@@ -74,124 +281,66 @@ def main():
                      config_dir=temp_dir,
                      wallet_location=temp_dir,
                      wallet_password=adw_env['userpwd'],
+                     # a claiming session per source on top of the load workers
                      min=3,
-                     max=5,
+                     max=max(5,adw_env.get('load_workers',4)+len(SOURCES)+1),
                      increment=1)
-    
+    return pool
 
-    
-    ################################
-    # crypto
-        # prepare the data for insertion
-        
-    ## reading Data from ADW to find the last ingestion
-    sql_query_crypto = "SELECT MAX(timestamp) FROM crypto"
+def load_settings(adw_env,make_store,argv=()):
+    return {'adw_env': adw_env,
+            'load_mode': adw_env.get('load_mode','staging'),
+            # objects are downloaded and decoded by a thread pool, each thread with its own client
+            'make_store': make_store,
+            'download_workers': adw_env.get('download_workers',8),
+            'download_budget': adw_env.get('download_budget_mb',256)*1024*1024,
+            'chunk_rows': adw_env.get('chunk_rows',DEFAULT_CHUNK_ROWS),
+            'batch_rows': adw_env.get('batch_rows',50000),
+            # rows gathered from the downloads before they are loaded: about one batch per load worker
+            'group_rows': adw_env.get('group_rows',adw_env.get('batch_rows',50000)*adw_env.get('load_workers',4)),
+            'run_id': time.strftime('%Y%m%dT%H%M%S',time.gmtime()),
+            # objects in the last lookback_days are diffed against the ledger; all of them every
+            # ledger_sweep_hours (0: never) and with --sweep, and objects under --reload prefixes are loaded again
+            'lookback_days': adw_env.get('ledger_lookback_days',7),
+            'sweep_hours': adw_env.get('ledger_sweep_hours',24),
+            'sweep': '--sweep' in argv,
+            'reload': reload_prefixes(argv)}
+
+def prepare_tables(pool,settings):
     with pool.acquire() as connection_adw:
-        with connection_adw.cursor() as cursor:
-            cursor.execute(sql_query_crypto)
-            last_timestamp = cursor.fetchall()[0][0]/1000
-    now = int(time.time())       
-            
-    list_objects_response=OSDS.list_object(adw_env['CW_ingest_path'])
-    
-    #limiting the list to unseen data in the table
-    list_objects_response=filter_obj_list(list_objects_response,last_timestamp,now)
+        create_ledger_table(connection_adw)
+        if settings['load_mode']=='staging':
+            create_staging_tables(connection_adw)
+
+def main():
     
-    data = []
-    for obj in list_objects_response:
-        if obj.name[-7:] == "parquet":
-            get_object_response = OSDS.get_object(obj.name)
-            parquet_table = pq.read_table(io.BytesIO(get_object_response.data.content))
-            df = parquet_table.to_pandas()
-            df = df.where(pd.notnull(df), None)
-            data += df[['date', 'rate', 'volume', 'cap', 'liquidity']].values.tolist()
-
-    # insert the data using MERGE statement to ignore duplicates
-    if data:
-        with pool.acquire() as connection_adw:
-            with connection_adw.cursor() as cursor:
-                try:
-                    cursor.executemany("""
-                        MERGE INTO Crypto c
-                        USING (SELECT :1 AS timestamp, :2 AS rate, :3 AS volume, :4 AS cap, :5 AS liquidity FROM dual) d
-                        ON (c.timestamp = d.timestamp)
-                        WHEN NOT MATCHED THEN
-                            INSERT (timestamp, rate, volume, cap, liquidity) VALUES (d.timestamp, d.rate, d.volume, d.cap, d.liquidity)""",
-                        [(int(row[0]) if row[0] is not None else None,
-                          float(row[1]) if row[1] is not None else None,
-                          int(row[2]) if row[2] is not None else None,
-                          int(row[3]) if row[3] is not None else None,
-                         float(row[4]) if not math.isnan(row[4]) else None) for row in data])
-
-                    # commit the transaction
-                    connection_adw.commit()
-                except Exception as e:
-                    print("Error during insert:", e)
-                    connection_adw.rollback()
-
-    ################
-    #news
-    # prepare the data for insertion
-    ## reading Data from ADW to find the last ingestion
-    sql_query_news = "SELECT MAX(pubdate) FROM news"
-    with pool.acquire() as connection_adw:
-        with connection_adw.cursor() as cursor:
-            cursor.execute(sql_query_news)
-            last_timestamp = int(cursor.fetchall()[0][0].timestamp())
-        
-    list_objects_response=OSDS.list_object(adw_env['ND_ingest_path'])
-    #limiting the list to unseen data in the table
-    list_objects_response=filter_obj_list(list_objects_response,last_timestamp,now)
+    env_str = sys.argv[1]
+    adw_env_str = sys.argv[2]
+    env = json.loads(env_str)
+    adw_env = json.loads(adw_env_str)
     
-    data = []
-    for obj in list_objects_response:
-        if obj.name[-7:] == "parquet":
-            get_object_response = OSDS.get_object(obj.name)
-            parquet_table = pq.read_table(io.BytesIO(get_object_response.data.content))
-            df = parquet_table.to_pandas()
-            # replace None with empty string
-            df = df.fillna('')
-            if not df.empty:
-                data += df[['pubDate', 'title', 'link', 'keywords', 'creator','video_url','description',
-                            'content','image_url','source_id','category','country','language']].values.tolist()
-
-    # insert the data using MERGE statement to ignore duplicates
-    if data:
-        with pool.acquire() as connection_adw:
-            with connection_adw.cursor() as cursor:
-                try:
+    OSDS=OS_Data_Store(env)
+    pool=create_adw_pool(OSDS,adw_env)
+    settings=load_settings(adw_env,lambda: OS_Data_Store(env),sys.argv[3:])
+    prepare_tables(pool,settings)
 
-                    cursor.executemany("""
-                            MERGE INTO News c
-                            USING (SELECT TO_DATE(:1, 'YYYY-MM-DD HH24:MI:SS') AS pubDate,
-                                          :2 AS title, 
-                                          :3 AS link, 
-                                          :4 AS keywords, 
-                                          :5 AS creator, 
-                                          :6 AS video_url, 
-                                          :7 AS description, 
-                                          :8 AS content, 
-                                          :9 AS image_url, 
-                                          :10 AS source_id, 
-                                          :11 AS category, 
-                                          :12 AS country,
-                                          :13 AS language
-                            FROM dual) d
-                            ON (c.pubDate = d.pubDate AND c.title = d.title )
-                            WHEN NOT MATCHED THEN
-                                INSERT (pubDate, title, link, keywords,creator,video_url,description,content,
-                                image_url,source_id, category,country, language) 
-                                VALUES (d.pubDate, d.title, d.link, d.keywords,d.creator,d.video_url,
-                                d.description,d.content,d.image_url,d.source_id, d.category,d.country, d.language)""",
-                            [(str(row[0]), str(row[1]),str(row[2]),str(row[3]),str(row[4]),str(row[5]),
-                             row[6][:4000] if row[6] is not None else None,
-                             row[7][:4000] if row[7] is not None else None,
-                             str(row[8]),str(row[9]),str(row[10]),str(row[11]),str(row[12])) for row in data])
-                    # commit the transaction
-                    connection_adw.commit()
+    # crypto and news run side by side, and their batches share load_workers sessions of the pool
+    summary=RunSummary()
+    meter=LoadMeter("OS2ADW ({})".format(settings['load_mode']))
+    loaded=0
+    with ThreadPoolExecutor(max_workers=adw_env.get('load_workers',4)) as batch_executor:
+        with ThreadPoolExecutor(max_workers=len(SOURCES)) as source_executor:
+            futures={name: source_executor.submit(run_source,name,OSDS,pool,batch_executor,settings,summary) for name in SOURCES}
+            for name,future in futures.items():
+                try:
+                    loaded+=future.result()
                 except Exception as e:
-                    print("Error during insert:", e)
-                    connection_adw.rollback()
+                    print("OS2ADW: {} failed:".format(name), e)
+    meter.report(loaded)
+    summary.report("OS2ADW")
+    # objects of failed batches are not in the ledger and are fetched again by the next run
+    if summary.failed():
+        sys.exit(1)
 
         
 if __name__=="__main__": 
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sys
+import types
+
+import pyarrow as pa
+from oci.exceptions import ServiceError
+
+from OS2ADW import (OS_Data_Store, SOURCES, OBJECT_COLUMN, create_adw_pool, load_batch, load_settings,
+                    prepare_tables)
+from adw_load import RunSummary, key_batches
+from compaction import live_objects, read_manifest
+from ledger import claim_objects, loaded_etag, record_loaded
+from watermark import OBJECT_NAME
+
+# Incremental OS2ADW: loads the single object named in an Object Storage "object created" event,
+# seconds after it lands, instead of waiting for the hourly run to list both prefixes.
+#
+#   OS2ADW_event.py <env> <adw_env> <event JSON, or path to a file holding it>
+#
+# The event is the one OCI Events emits (utils.Events.create_rule with the condition
+#   {"eventType": ["com.oraclecloud.objectstorage.createobject"], "data": {"additionalDetails": {"bucketName": [...]}}}
+# and its topic delivering to whatever starts this run); only these fields are used:
+#   {"eventType": "com.oraclecloud.objectstorage.createobject",
+#    "data": {"resourceName": "data-lake/raw-data/crypto/year=2023/.../rc..._..._....parquet",
+#             "additionalDetails": {"eTag": "..."}}}
+#
+# Redelivered events are no-ops: the ingest ledger already holds the object with that ETag. The object is
+# claimed in the ledger first (ledger.claim_objects), so a redelivery handled at the same time, or an
+# hourly run loading the same object, leaves it to whoever claimed it first. The hourly
+# OS2ADW keeps running as the safety net for anything an event missed. With "local_store_dir" in env,
+# objects are read from (and quarantine files written to) a local directory instead of the bucket.
+# tests/data/objectstorage_createobject_event.json is a sample event; tests/test_OS2ADW_event.py
+# replays it against a Local_Data_Store and a stand-in pool.
+
+
+class Local_Data_Store:
+    # stand-in for OS_Data_Store on a local directory; the ETag is the md5 of the content
+    def __init__(self,root):
+        self.root=root
+
+    def create_object(self, object_body, path, **kwargs):
+        full_path=os.path.join(self.root,path)
+        os.makedirs(os.path.dirname(full_path),exist_ok=True)
+        with open(full_path,'wb') as f:
+            f.write(object_body.encode() if isinstance(object_body,str) else object_body)
+
+    def get_object(self,path):
+        full_path=os.path.join(self.root,path)
+        if not os.path.exists(full_path):
+            raise ServiceError(404,'ObjectNotFound',{},'{} not found'.format(path))
+        with open(full_path,'rb') as f:
+            content=f.read()
+        return types.SimpleNamespace(data=types.SimpleNamespace(content=content),
+                                     headers={'etag': hashlib.md5(content).hexdigest()})
+
+
+def parse_event(event):
+    data=event['data']
+    return data['resourceName'],(data.get('additionalDetails') or {}).get('eTag')
+
+def source_of(object_name,adw_env):
+    for name,source in SOURCES.items():
+        if object_name.startswith(adw_env[source['path_key']].rstrip('/')+'/'):
+            return name
+    return None
+
+def handle_event(event,OSDS,pool,settings,summary):
+    # returns the number of rows sent to the database (0 when the event is skipped)
+    object_name,event_etag=parse_event(event)
+    name=source_of(object_name,settings['adw_env'])
+    if name is None or not OBJECT_NAME.search(object_name):
+        print("OS2ADW_event: {} is not an ingest object, skipped".format(object_name))
+        return 0
+    ingest_path=settings['adw_env'][SOURCES[name]['path_key']]
+    obj=types.SimpleNamespace(name=object_name,etag=event_etag)
+
+    # replaced small objects and compacted objects not published yet are left to the hourly run
+    compaction_manifest,_=read_manifest(OSDS,ingest_path)
+    if not live_objects([obj],compaction_manifest):
+        print("OS2ADW_event: {} is not live in the compaction manifest, skipped".format(object_name))
+        return 0
+
+    # the claim is held on this session until record_loaded commits (or the session is released, which
+    # rolls it back)
+    with pool.acquire() as connection_claim:
+        if not claim_objects(connection_claim,name,[object_name]):
+            print("OS2ADW_event: {} is being loaded by another run, skipped".format(object_name))
+            return 0
+        etag=loaded_etag(connection_claim,object_name)
+        if etag is not None and etag==event_etag:
+            print("OS2ADW_event: {} already loaded with ETag {}, skipped".format(object_name,etag))
+            connection_claim.rollback()
+            return 0
+
+        with summary.stage(name,'fetch',object_name):
+            response=OSDS.get_object(object_name)
+            # the object may have been overwritten since the event; what is loaded is what gets recorded
+            obj.etag=response.headers.get('etag')
+            table=SOURCES[name]['read'](response.data.content)
+        table=table.append_column(OBJECT_COLUMN,pa.array([0]*table.num_rows,pa.int32()))
+
+        loaded=0
+        batches=key_batches(table,SOURCES[name]['key'],settings['batch_rows'])
+        for i,batch in enumerate(batches):
+            detail='{} batch {}/{}: {} rows'.format(object_name.rsplit('/',1)[-1],i+1,len(batches),batch.num_rows)
+            loaded+=load_batch(pool,name,batch,i+1,detail,settings,summary).num_rows
+
+        with summary.stage(name,'record_ledger'):
+            record_loaded(connection_claim,name,[(obj,table.num_rows)])
+    return loaded
+
+def main(pool=None):
+    # pool: an existing session pool (or a stand-in) instead of one created from the wallet in adw_env
+
+    env_str = sys.argv[1]
+    adw_env_str = sys.argv[2]
+    env = json.loads(env_str)
+    adw_env = json.loads(adw_env_str)
+    event_arg = sys.argv[3]
+    if event_arg.lstrip().startswith('{'):
+        event = json.loads(event_arg)
+    else:
+        with open(event_arg) as f:
+            event = json.load(f)
+
+    if env.get('local_store_dir'):
+        make_store=lambda: Local_Data_Store(env['local_store_dir'])
+    else:
+        make_store=lambda: OS_Data_Store(env)
+    OSDS=make_store()
+    if pool is None:
+        pool=create_adw_pool(OSDS,adw_env)
+    settings=load_settings(adw_env,make_store)
+    prepare_tables(pool,settings)
+
+    summary=RunSummary()
+    failed=False
+    try:
+        handle_event(event,OSDS,pool,settings,summary)
+    except Exception as e:
+        print("OS2ADW_event: failed:", e)
+        failed=True
+    summary.report("OS2ADW_event")
+    # a failed event is retried by redelivery, or picked up by the next hourly run through the ledger
+    if failed or summary.failed():
+        sys.exit(1)
+
+
+if __name__=="__main__":
+    main()
@@ -11,6 +11,8 @@ import oracledb
 import math
 import tempfile
 
+from compaction import live_objects, read_manifest
+
 
 class OS_Data_Store:
     def __init__(self,env):
@@ -79,6 +81,9 @@ def main():
     # crypto
         # prepare the data for insertion
     list_objects_response=OSDS.list_object(adw_env['CW_ingest_path'])
+    # hide small objects already merged by the compaction job
+    compaction_manifest,_=read_manifest(OSDS,adw_env['CW_ingest_path'])
+    list_objects_response=live_objects(list_objects_response,compaction_manifest)
     data = []
     for obj in list_objects_response:
         if obj.name[-7:] == "parquet":
@@ -120,6 +125,8 @@ def main():
     #news
     # prepare the data for insertion
     list_objects_response=OSDS.list_object(adw_env['ND_ingest_path'])
+    compaction_manifest,_=read_manifest(OSDS,adw_env['ND_ingest_path'])
+    list_objects_response=live_objects(list_objects_response,compaction_manifest)
     data = []
     for obj in list_objects_response:
         if obj.name[-7:] == "parquet":
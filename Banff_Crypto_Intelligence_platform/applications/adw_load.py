@@ -0,0 +1,310 @@
+import contextlib
+import resource
+import threading
+import time
+
+import oracledb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from schemas import CW_SCHEMA, ND_SCHEMA, conform
+
+
+# Load strategies for the Crypto and News tables used by OS2ADW.
+#
+#   "merge"   : the original path, one MERGE ... USING (SELECT :1 ... FROM dual) per row
+#   "staging" : array-insert a chunk into a session-private global temporary table, then a single
+#               set-based MERGE from the staging table. Duplicates inside the chunk (overlapping
+#               ingest windows) are removed with ROW_NUMBER() before the MERGE.
+#
+# adw_env["load_mode"] selects the strategy, "staging" by default.
+#
+# Rows go from parquet to the database without pandas: only the loaded columns are read, every Arrow
+# column is converted once per chunk into a list of bind values (NaN -> NULL, volume/cap -> int, long
+# texts cut to 4000 characters, lists rendered as the pandas path used to store them), and the chunks
+# of chunk_rows rows are sent with executemany and fixed input sizes. Every chunk is committed on its
+# own; rows the database rejects are returned for quarantine instead of failing the load. In staging
+# mode a chunk whose set-based MERGE fails is rolled back and merged again with the per-row MERGE.
+
+CRYPTO_COLUMNS = ['timestamp', 'rate', 'volume', 'cap', 'liquidity']
+NEWS_COLUMNS = ['pubDate', 'title', 'link', 'keywords', 'creator', 'video_url', 'description',
+                'content', 'image_url', 'source_id', 'category', 'country', 'language']
+
+SQL_MERGE_CRYPTO_ROW = """
+    MERGE INTO Crypto c
+    USING (SELECT :1 AS timestamp, :2 AS rate, :3 AS volume, :4 AS cap, :5 AS liquidity FROM dual) d
+    ON (c.timestamp = d.timestamp)
+    WHEN NOT MATCHED THEN
+        INSERT (timestamp, rate, volume, cap, liquidity) VALUES (d.timestamp, d.rate, d.volume, d.cap, d.liquidity)"""
+
+SQL_MERGE_NEWS_ROW = """
+    MERGE INTO News c
+    USING (SELECT TO_DATE(:1, 'YYYY-MM-DD HH24:MI:SS') AS pubDate,
+                  :2 AS title,
+                  :3 AS link,
+                  :4 AS keywords,
+                  :5 AS creator,
+                  :6 AS video_url,
+                  :7 AS description,
+                  :8 AS content,
+                  :9 AS image_url,
+                  :10 AS source_id,
+                  :11 AS category,
+                  :12 AS country,
+                  :13 AS language
+    FROM dual) d
+    ON (c.pubDate = d.pubDate AND c.title = d.title )
+    WHEN NOT MATCHED THEN
+        INSERT (pubDate, title, link, keywords,creator,video_url,description,content,
+        image_url,source_id, category,country, language)
+        VALUES (d.pubDate, d.title, d.link, d.keywords,d.creator,d.video_url,
+        d.description,d.content,d.image_url,d.source_id, d.category,d.country, d.language)"""
+
+# ON COMMIT DELETE ROWS: every session only sees its own rows, and they disappear at commit
+SQL_CREATE_CRYPTO_STAGE = """
+    CREATE GLOBAL TEMPORARY TABLE Crypto_Stage (timestamp NUMBER,
+                                                rate NUMBER,
+                                                volume NUMBER,
+                                                cap NUMBER,
+                                                liquidity NUMBER)
+    ON COMMIT DELETE ROWS"""
+
+SQL_CREATE_NEWS_STAGE = """
+    CREATE GLOBAL TEMPORARY TABLE News_Stage (
+            pubDate DATE,
+            title VARCHAR2(4000),
+            link VARCHAR2(4000),
+            keywords VARCHAR2(4000),
+            creator VARCHAR2(256),
+            video_url VARCHAR2(256),
+            description CLOB,
+            content CLOB,
+            image_url VARCHAR2(4000),
+            source_id VARCHAR2(64),
+            category VARCHAR2(64),
+            country VARCHAR2(256),
+            language VARCHAR2(64))
+    ON COMMIT DELETE ROWS"""
+
+SQL_INSERT_CRYPTO_STAGE = """
+    INSERT INTO Crypto_Stage (timestamp, rate, volume, cap, liquidity) VALUES (:1, :2, :3, :4, :5)"""
+
+SQL_INSERT_NEWS_STAGE = """
+    INSERT INTO News_Stage (pubDate, title, link, keywords, creator, video_url, description, content,
+                            image_url, source_id, category, country, language)
+    VALUES (TO_DATE(:1, 'YYYY-MM-DD HH24:MI:SS'), :2, :3, :4, :5, :6, :7, :8, :9, :10, :11, :12, :13)"""
+
+SQL_MERGE_CRYPTO_STAGE = """
+    MERGE INTO Crypto c
+    USING (SELECT timestamp, rate, volume, cap, liquidity
+           FROM (SELECT s.*, ROW_NUMBER() OVER (PARTITION BY timestamp ORDER BY ROWNUM) AS rn
+                 FROM Crypto_Stage s)
+           WHERE rn = 1) d
+    ON (c.timestamp = d.timestamp)
+    WHEN NOT MATCHED THEN
+        INSERT (timestamp, rate, volume, cap, liquidity) VALUES (d.timestamp, d.rate, d.volume, d.cap, d.liquidity)"""
+
+SQL_MERGE_NEWS_STAGE = """
+    MERGE INTO News c
+    USING (SELECT pubDate, title, link, keywords, creator, video_url, description, content,
+                  image_url, source_id, category, country, language
+           FROM (SELECT s.*, ROW_NUMBER() OVER (PARTITION BY pubDate, title ORDER BY ROWNUM) AS rn
+                 FROM News_Stage s)
+           WHERE rn = 1) d
+    ON (c.pubDate = d.pubDate AND c.title = d.title )
+    WHEN NOT MATCHED THEN
+        INSERT (pubDate, title, link, keywords,creator,video_url,description,content,
+        image_url,source_id, category,country, language)
+        VALUES (d.pubDate, d.title, d.link, d.keywords,d.creator,d.video_url,
+        d.description,d.content,d.image_url,d.source_id, d.category,d.country, d.language)"""
+
+
+# (parquet column, bind conversion), in bind order
+CRYPTO_BINDS = [('date', 'int'), ('rate', 'float'), ('volume', 'int'), ('cap', 'int'), ('liquidity', 'float')]
+NEWS_BINDS = [('pubDate', 'str'), ('title', 'str'), ('link', 'str'), ('keywords', 'list'), ('creator', 'list'),
+              ('video_url', 'str'), ('description', 'text'), ('content', 'text'), ('image_url', 'str'),
+              ('source_id', 'str'), ('category', 'list'), ('country', 'list'), ('language', 'str')]
+
+# sizes of the News columns; description and content are CLOBs. LONG binds are only allowed as the
+# values of an INSERT, so they are used for the staging insert; the per-row MERGE binds them into the
+# SELECT ... FROM dual of its USING clause (ORA-00997 with LONG), so there they go as CLOBs
+CRYPTO_INPUT_SIZES = [oracledb.DB_TYPE_NUMBER] * 5
+NEWS_INPUT_SIZES = [19, 4000, 4000, 4000, 256, 256, oracledb.DB_TYPE_LONG, oracledb.DB_TYPE_LONG,
+                    4000, 64, 64, 256, 64]
+NEWS_ROW_INPUT_SIZES = [19, 4000, 4000, 4000, 256, 256, oracledb.DB_TYPE_CLOB, oracledb.DB_TYPE_CLOB,
+                        4000, 64, 64, 256, 64]
+
+# legacy files may hold nulls in fields the ingest schemas declare non-nullable
+CRYPTO_LOAD_SCHEMA = pa.schema([CW_SCHEMA.field(name).with_nullable(True) for name, _ in CRYPTO_BINDS])
+NEWS_LOAD_SCHEMA = pa.schema([ND_SCHEMA.field(name).with_nullable(True) for name, _ in NEWS_BINDS])
+
+DEFAULT_CHUNK_ROWS = 5000
+
+
+def read_table(content, schema):
+    # only the columns that are loaded are read; missing ones come back as nulls
+    parquet_file = pq.ParquetFile(pa.BufferReader(content))
+    columns = [name for name in schema.names if name in parquet_file.schema_arrow.names]
+    return conform(parquet_file.read(columns=columns), schema)
+
+
+def read_crypto(content):
+    return read_table(content, CRYPTO_LOAD_SCHEMA)
+
+
+def read_news(content):
+    return read_table(content, NEWS_LOAD_SCHEMA)
+
+
+def _list_text(values):
+    # str() of the numpy array the pandas path got for a list cell, e.g. "['bitcoin' 'crypto']"
+    return '[' + ' '.join(repr(v) for v in values) + ']'
+
+
+def bind_values(column, kind):
+    if kind in ('int', 'float') and pa.types.is_floating(column.type):
+        column = pc.if_else(pc.is_nan(column), pa.scalar(None, column.type), column)
+    if kind == 'int':
+        return pc.cast(column, pa.int64(), safe=False).to_pylist()
+    if kind == 'text':
+        return pc.utf8_slice_codeunits(column, 0, 4000).to_pylist()
+    if kind == 'list':
+        return [None if v is None else _list_text(v) for v in column.to_pylist()]
+    return column.to_pylist()
+
+
+def bind_chunks(table, binds, chunk_rows=DEFAULT_CHUNK_ROWS):
+    for offset in range(0, table.num_rows, chunk_rows):
+        chunk = table.slice(offset, chunk_rows)
+        yield list(zip(*[bind_values(chunk[name], kind) for name, kind in binds]))
+
+
+def create_staging_tables(connection):
+    with connection.cursor() as cursor:
+        for sql in (SQL_CREATE_CRYPTO_STAGE, SQL_CREATE_NEWS_STAGE):
+            try:
+                cursor.execute(sql)
+            except oracledb.DatabaseError as e:
+                # ORA-00955: name is already used by an existing object
+                if e.args[0].code != 955:
+                    raise
+
+
+def key_batches(table, key, batch_rows):
+    # sorted slices of about batch_rows rows; rows with the same key always land in the same slice, so
+    # batches merged concurrently from different sessions never insert the same key twice
+    if table.num_rows == 0:
+        return []
+    table = table.sort_by(key)
+    keys = table[key]
+    batches = []
+    start = 0
+    while start < table.num_rows:
+        end = min(start + batch_rows, table.num_rows)
+        while end < table.num_rows and keys[end] == keys[end - 1]:
+            end += 1
+        batches.append(table.slice(start, end - start))
+        start = end
+    return batches
+
+
+def execute_rows(cursor, sql, input_sizes, rows):
+    # executemany with batcherrors: (rows inserted, [(offset, message)] of the rows the database refused)
+    cursor.setinputsizes(*input_sizes)
+    cursor.executemany(sql, rows, batcherrors=True, arraydmlrowcounts=True)
+    errors = [(error.offset, error.message) for error in cursor.getbatcherrors()]
+    return sum(cursor.getarraydmlrowcounts()), errors
+
+
+def load_table(connection, table, binds, input_sizes, insert_sql, merge_sql=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+               row_sql=None, row_input_sizes=None):
+    # every chunk is array-inserted (and, with merge_sql, merged from the staging table) and committed
+    # on its own. Rows the database rejects do not fail the chunk: with batcherrors they are collected
+    # and returned, with the error, for quarantine. Returns (per-chunk counts, [(row offset in table,
+    # rejected row)]).
+    names = [name for name, _ in binds]
+    chunks = []
+    rejected = []
+    start = 0
+    with connection.cursor() as cursor:
+        for rows in bind_chunks(table, binds, chunk_rows):
+            inserted, errors = execute_rows(cursor, insert_sql, input_sizes, rows)
+            if merge_sql:
+                try:
+                    cursor.execute(merge_sql)
+                    inserted = cursor.rowcount
+                except oracledb.DatabaseError as e:
+                    # a row the staging table took but the target refuses (NOT NULL, length, ...) fails the
+                    # whole set-based MERGE: the chunk is rolled back and merged again row by row, so only
+                    # the offending rows are rejected
+                    connection.rollback()
+                    print("adw_load: set-based MERGE of {} rows failed, retrying row by row:".format(len(rows)), e)
+                    inserted, errors = execute_rows(cursor, row_sql, row_input_sizes, rows)
+            connection.commit()
+            chunks.append({'rows': len(rows), 'inserted': inserted, 'rejected': len(errors),
+                           'duplicates': len(rows) - len(errors) - inserted})
+            for offset, message in errors:
+                rejected.append((start + offset, dict(zip(names, rows[offset]), error=message)))
+            start += len(rows)
+    return chunks, rejected
+
+
+def load_crypto(connection, table, load_mode="staging", chunk_rows=DEFAULT_CHUNK_ROWS):
+    if load_mode == "merge":
+        return load_table(connection, table, CRYPTO_BINDS, CRYPTO_INPUT_SIZES, SQL_MERGE_CRYPTO_ROW, chunk_rows=chunk_rows)
+    return load_table(connection, table, CRYPTO_BINDS, CRYPTO_INPUT_SIZES, SQL_INSERT_CRYPTO_STAGE, SQL_MERGE_CRYPTO_STAGE,
+                      chunk_rows, SQL_MERGE_CRYPTO_ROW, CRYPTO_INPUT_SIZES)
+
+
+def load_news(connection, table, load_mode="staging", chunk_rows=DEFAULT_CHUNK_ROWS):
+    if load_mode == "merge":
+        return load_table(connection, table, NEWS_BINDS, NEWS_ROW_INPUT_SIZES, SQL_MERGE_NEWS_ROW, chunk_rows=chunk_rows)
+    return load_table(connection, table, NEWS_BINDS, NEWS_INPUT_SIZES, SQL_INSERT_NEWS_STAGE, SQL_MERGE_NEWS_STAGE,
+                      chunk_rows, SQL_MERGE_NEWS_ROW, NEWS_ROW_INPUT_SIZES)
+
+
+class LoadMeter:
+    # wall time, CPU time and peak memory of one load, reported per 100k rows
+    def __init__(self, label):
+        self.label = label
+        self.wall = time.monotonic()
+        self.cpu = time.process_time()
+
+    def report(self, rows):
+        wall = time.monotonic() - self.wall
+        cpu = time.process_time() - self.cpu
+        per_100k = 100000 / max(rows, 1)
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        arrow_peak_mb = pa.default_memory_pool().max_memory() / 1e6
+        print("{}: {} rows in {:.1f}s, cpu {:.2f}s per 100k rows, peak rss {:.0f} MB, arrow peak {:.0f} MB".format(
+            self.label, rows, wall, cpu * per_100k, peak_rss_mb, arrow_peak_mb))
+
+
+class RunSummary:
+    # durations and outcome of every stage of a run, printed at the end of the job
+    def __init__(self):
+        self.stages = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, source, name, detail=''):
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(source, name, time.monotonic() - started, False, "{} {}".format(detail, e).strip())
+            raise
+        self.record(source, name, time.monotonic() - started, True, detail)
+
+    def record(self, source, name, seconds, ok, detail=''):
+        with self.lock:
+            self.stages.append((source, name, seconds, ok, detail))
+
+    def failed(self):
+        return [stage for stage in self.stages if not stage[3]]
+
+    def report(self, label):
+        print("{}: run summary".format(label))
+        for source, name, seconds, ok, detail in self.stages:
+            print("  {:<8} {:<16} {:>8.1f}s {:<6} {}".format(source, name, seconds, "ok" if ok else "FAILED", detail))
@@ -0,0 +1,104 @@
+import datetime
+import json
+import multiprocessing
+import time
+
+from watermark import manifest_path
+
+
+# Backfill planner for the *_history ingest jobs.
+#
+# The requested range is cut into shards (shard_hours each) that run in separate processes. Inside a
+# shard the request window adapts to the observed response density: it grows while responses stay
+# well under the API's per-response limit and shrinks (re-requesting the same window) when a response
+# comes back full and was probably truncated. Every finished shard writes a checkpoint object
+#   <ingest parent>/_manifests/<source>.backfill/<start>_<end>.json
+# and a rerun skips the shards that already have one, so a failure only costs the shard it hit
+# (as long as from_date and shard_hours are unchanged between runs).
+#
+# History env keys: "shard_hours" (default 168), "backfill_processes" (4), "max_points" (API limit),
+# "interval_hour" (initial window), "min_interval_hour" / "max_interval_hour".
+
+
+class AdaptiveWindow:
+    def __init__(self, initial_hours, max_points, min_hours=0.25, max_hours=24*7, target_fill=0.7, refetch_full=True):
+        self.seconds = initial_hours * 3600
+        self.max_points = max_points
+        self.min_seconds = min_hours * 3600
+        self.max_seconds = max_hours * 3600
+        self.target_fill = target_fill
+        # False for paginated sources, where a full response is complete and only the next window shrinks
+        self.refetch_full = refetch_full
+
+    def clamp(self, seconds):
+        return int(min(self.max_seconds, max(self.min_seconds, seconds)))
+
+    def walk(self, start, end, fetch, count):
+        # fetch(window_start, window_end) -> payload, count(payload) -> number of points in it.
+        # yields (window_start, window_end, payload) covering [start, end) without gaps.
+        t = start
+        while t < end:
+            window_end = min(t + self.clamp(self.seconds), end)
+            payload = fetch(t, window_end)
+            points = count(payload)
+            if self.refetch_full and points >= self.max_points and window_end - t > self.min_seconds:
+                self.seconds = self.clamp((window_end - t) / 2)
+                continue
+            yield t, window_end, payload
+            density = points / max(window_end - t, 1)
+            if density > 0:
+                self.seconds = self.clamp(self.target_fill * self.max_points / density)
+            else:
+                self.seconds = self.clamp(self.seconds * 2)
+            t = window_end
+
+
+def plan_shards(from_ts, to_ts, shard_hours):
+    step = int(shard_hours * 3600)
+    return [(t, min(t + step, to_ts)) for t in range(from_ts, to_ts, step)]
+
+
+def checkpoint_prefix(ingest_path):
+    return manifest_path(ingest_path, '.backfill/')
+
+
+def checkpoint_name(ingest_path, shard):
+    return '{}{}_{}.json'.format(checkpoint_prefix(ingest_path), shard[0], shard[1])
+
+
+def completed_shards(OSDS, ingest_path):
+    done = set()
+    for obj in OSDS.list_object(checkpoint_prefix(ingest_path)):
+        start, end = obj.name.rsplit('/', 1)[-1][:-len('.json')].split('_')
+        done.add((int(start), int(end)))
+    return done
+
+
+def write_checkpoint(OSDS, ingest_path, shard, stats):
+    stats = dict(stats, start=shard[0], end=shard[1], finished_at=datetime.datetime.utcnow().isoformat())
+    OSDS.create_object(json.dumps(stats), checkpoint_name(ingest_path, shard))
+
+
+def run_backfill(OSDS, ingest_path, from_ts, to_ts, run_shard, args, history_env, label):
+    # run_shard(*args, shard) must be a module-level function of the calling job: it runs in a
+    # child process and builds its own clients there.
+    shards = plan_shards(from_ts, to_ts, history_env.get("shard_hours", 24*7))
+    done = completed_shards(OSDS, ingest_path)
+    todo = [shard for shard in shards if shard not in done]
+    print("{}: {} shards, {} already done, {} to run".format(label, len(shards), len(shards) - len(todo), len(todo)))
+
+    started = time.monotonic()
+    failed = []
+    processes = max(1, min(history_env.get("backfill_processes", 4), len(todo)))
+    with multiprocessing.Pool(processes) as pool:
+        results = [(shard, pool.apply_async(run_shard, args + (shard,))) for shard in todo]
+        for shard, result in results:
+            try:
+                stats = result.get()
+                write_checkpoint(OSDS, ingest_path, shard, stats)
+                print("{}: shard {}-{} done: {}".format(label, shard[0], shard[1], stats))
+            except Exception as e:
+                failed.append(shard)
+                print("{}: shard {}-{} failed, rerun to resume:".format(label, shard[0], shard[1]), e)
+    print("{}: finished {} shards in {:.1f}s, {} failed".format(label, len(todo) - len(failed), time.monotonic() - started, len(failed)))
+    return failed
@@ -0,0 +1,235 @@
+import oci
+import datetime
+import io
+import json
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from oci.exceptions import ServiceError
+
+from watermark import OBJECT_NAME, manifest_path
+from parquet_io import parquet_settings, upload_table
+from partitions import day_prefix, month_prefix
+from schemas import CW_SCHEMA, ND_SCHEMA, conform
+
+
+# Compaction of the small per-interval ingest objects (rc*/rn*.parquet, one per 8-hour window)
+# into one object per day or month.
+#
+# Compacted objects are written into the day (or month) partition they cover as
+# compacted_<prefix><ingest>_<start>_<end>.parquet, keeping the naming contract of filter_obj_list,
+# <start>/<end> being the earliest and latest window they cover. The swap is done through a manifest object (_manifests/<source>.compaction.json):
+#   compacted : compacted objects that are live
+#   replaced  : small (or older compacted) objects superseded by a live compacted object
+#   merged_from : live compacted object -> the small ingest objects whose rows it holds (through older
+#                 compacted objects too), so OS2ADW can tell a compacted object brings no new rows
+# Readers call live_objects() on their listing: objects in "replaced" are hidden, and compacted_
+# objects are only visible once they appear in "compacted". Writing the manifest is a single
+# conditional PUT, so readers see either the old set of files or the new one, never a mix.
+# Replaced objects are deleted on the following compaction run, once no reader can still be
+# working from the previous manifest.
+#
+#   compaction.py <env> <compaction_env>
+#   compaction_env = {"CW_ingest_path": ..., "ND_ingest_path": ..., "granularity": "day",
+#                     "min_age_hours": 48, "parquet": {...}}
+
+SOURCES = {
+    'crypto': {'path_key': 'CW_ingest_path', 'prefix': 'rc', 'keys': ['date'], 'order': ['date'], 'schema': CW_SCHEMA},
+    'news':   {'path_key': 'ND_ingest_path', 'prefix': 'rn', 'keys': ['pubDate', 'title'], 'order': ['pubDate'], 'schema': ND_SCHEMA},
+}
+
+PARTITION_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m'}
+PARTITION_PREFIXES = {'day': day_prefix, 'month': month_prefix}
+
+
+class OS_Data_Store:
+    def __init__(self,env):
+        resource_principals_signer = oci.auth.signers.get_resource_principals_signer()
+        self.object_storage_client = oci.object_storage.ObjectStorageClient({},signer=resource_principals_signer)
+        self.namespace_name = env["namespace_name"]
+        self.compartment_id = env["compartment_id"]
+        self.bucket_name    = env["bucket_name"]
+
+    def create_object(self, object_body, path, **kwargs):
+        response=self.object_storage_client.put_object(namespace_name = self.namespace_name,bucket_name= self.bucket_name,object_name= path,put_object_body = object_body,**kwargs)
+        return response
+
+    def upload_stream(self, stream, path, part_size):
+        upload_manager=oci.object_storage.UploadManager(self.object_storage_client,allow_parallel_uploads=True)
+        response=upload_manager.upload_stream(self.namespace_name,self.bucket_name,path,stream,part_size=part_size)
+        return response
+
+    def get_object(self,path):
+        response= self.object_storage_client.get_object(namespace_name=self.namespace_name,bucket_name= self.bucket_name,object_name=path)
+        return response
+
+    def delete_object(self,path):
+        response= self.object_storage_client.delete_object(namespace_name=self.namespace_name,bucket_name= self.bucket_name,object_name=path)
+        return response
+
+    def list_object(self,prefix):
+        objects = []
+        start=None
+        while True:
+            list_objects_response = self.object_storage_client.list_objects(namespace_name=self.namespace_name,
+                                                                        bucket_name=self.bucket_name,prefix=prefix,start=start)
+            objects += list_objects_response.data.objects
+            if not list_objects_response.data.next_start_with:
+                break
+            start = list_objects_response.data.next_start_with
+        return objects
+
+
+def read_manifest(OSDS, ingest_path):
+    # returns (manifest, etag); an empty manifest when the prefix was never compacted
+    try:
+        response = OSDS.get_object(manifest_path(ingest_path, '.compaction.json'))
+    except ServiceError as e:
+        if e.status == 404:
+            return {'generation': 0, 'compacted': [], 'replaced': []}, None
+        raise
+    return json.loads(response.data.content), response.headers.get('etag')
+
+
+def write_manifest(OSDS, ingest_path, manifest, etag):
+    path = manifest_path(ingest_path, '.compaction.json')
+    if etag:
+        return OSDS.create_object(json.dumps(manifest), path, if_match=etag)
+    return OSDS.create_object(json.dumps(manifest), path, if_none_match='*')
+
+
+def is_compacted(name):
+    return name.rsplit('/', 1)[-1].startswith('compacted_')
+
+
+def live_objects(objects, manifest):
+    replaced = set(manifest['replaced'])
+    compacted = set(manifest['compacted'])
+    return [obj for obj in objects
+            if obj.name not in replaced and (not is_compacted(obj.name) or obj.name in compacted)]
+
+
+def window(name):
+    start, end = OBJECT_NAME.search(name).groups()
+    return int(start), int(end)
+
+
+def partition_end(start, granularity):
+    day = datetime.datetime.utcfromtimestamp(start).replace(hour=0, minute=0, second=0, tzinfo=datetime.timezone.utc)
+    if granularity == 'day':
+        return int((day + datetime.timedelta(days=1)).timestamp())
+    next_month = (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+    return int(next_month.timestamp())
+
+
+def plan(objects, granularity, closed_before):
+    # group objects by the partition their window starts in; only partitions that closed
+    # before `closed_before` (epoch seconds) are touched, so the current day keeps growing
+    fmt = PARTITION_FORMATS[granularity]
+    groups = {}
+    for obj in objects:
+        if not OBJECT_NAME.search(obj.name):
+            continue
+        start, end = window(obj.name)
+        if max(end, partition_end(start, granularity)) > closed_before:
+            continue
+        key = datetime.datetime.utcfromtimestamp(start).strftime(fmt)
+        groups.setdefault(key, []).append(obj)
+    # a partition made of a single compacted object is already done
+    return {key: objs for key, objs in groups.items() if len(objs) > 1}
+
+
+def merge(OSDS, objects, source):
+    tables = []
+    for obj in objects:
+        get_object_response = OSDS.get_object(obj.name)
+        table = pq.read_table(io.BytesIO(get_object_response.data.content))
+        if table.num_rows:
+            # files written before the fixed schemas may have inferred other types
+            tables.append(conform(table, source['schema']))
+    if not tables:
+        return None
+    table = pa.concat_tables(tables)
+    # overlapping ingest windows return the same points/articles more than once
+    duplicated = table.select(source['keys']).to_pandas().duplicated(keep='last').values
+    table = table.filter(pa.array(~duplicated))
+    # sorted rows give tight min/max statistics per row group, so readers can skip row groups
+    return table.sort_by([(column, 'ascending') for column in source['order']])
+
+
+def compact_source(OSDS, ingest_path, source, compaction_env):
+    granularity = compaction_env.get('granularity', 'day')
+    closed_before = int(time.time()) - 3600 * compaction_env.get('min_age_hours', 48)
+    settings = parquet_settings(compaction_env)
+
+    manifest, etag = read_manifest(OSDS, ingest_path)
+
+    # objects replaced by the previous run are no longer referenced by any reader
+    for name in manifest['replaced']:
+        try:
+            OSDS.delete_object(name)
+        except ServiceError as e:
+            if e.status != 404:
+                raise
+    manifest['replaced'] = []
+
+    objects = live_objects(OSDS.list_object(ingest_path), manifest)
+    groups = plan(objects, granularity, closed_before)
+
+    compacted = set(manifest['compacted'])
+    merged_from = manifest.get('merged_from', {})
+    replaced = []
+    stats = {'partitions': 0, 'objects_in': 0, 'rows_out': 0}
+    for key, group in sorted(groups.items()):
+        try:
+            table = merge(OSDS, group, source)
+            starts, ends = zip(*(window(obj.name) for obj in group))
+            name = '{}compacted_{}{}_{}_{}.parquet'.format(PARTITION_PREFIXES[granularity](ingest_path, min(starts)),
+                                                           source['prefix'], int(time.time()), min(starts), max(ends))
+            if table is not None:
+                upload_table(OSDS, table, name, settings)
+                compacted.add(name)
+                merged_from[name] = sorted({original for obj in group for original in merged_from.get(obj.name, [obj.name])})
+                stats['rows_out'] += table.num_rows
+            for obj in group:
+                compacted.discard(obj.name)
+                replaced.append(obj.name)
+            stats['partitions'] += 1
+            stats['objects_in'] += len(group)
+        except Exception as e:
+            print("COMPACTION: skipping partition {} of {}:".format(key, ingest_path), e)
+
+    manifest.update({
+        'generation': manifest['generation'] + 1,
+        'granularity': granularity,
+        'compacted': sorted(compacted),
+        'replaced': replaced,
+        'merged_from': {name: originals for name, originals in merged_from.items() if name in compacted},
+        'updated_at': datetime.datetime.utcnow().isoformat(),
+    })
+    # the swap: after this PUT readers ignore the small objects and read the compacted ones
+    write_manifest(OSDS, ingest_path, manifest, etag)
+    return stats
+
+
+def main():
+
+    env_str = sys.argv[1]
+    compaction_env_str = sys.argv[2]
+    env = json.loads(env_str)
+    compaction_env = json.loads(compaction_env_str)
+
+    OSDS=OS_Data_Store(env)
+    for name, source in SOURCES.items():
+        if source['path_key'] not in compaction_env:
+            continue
+        started = time.monotonic()
+        stats = compact_source(OSDS, compaction_env[source['path_key']], source, compaction_env)
+        print("COMPACTION: {}: {} partitions, {} objects -> {} rows in {:.1f}s".format(
+            name, stats['partitions'], stats['objects_in'], stats['rows_out'], time.monotonic() - started))
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,94 @@
+import datetime
+import hashlib
+import io
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from oci.exceptions import ServiceError
+
+from watermark import manifest_path
+
+
+# Client-side duplicate pre-filter for News. Ingest windows overlap, so many fetched rows are already
+# in the table; the MERGE would reject them one by one after they have been bound and sent. Instead
+# OS2ADW keeps the 64-bit digests of the (pubDate, title) keys already loaded for the time window of
+# the rows being loaded (one query per group of objects) and drops known rows before any bind happens. A collision could drop a new row,
+# but with 64-bit digests and a window of a few hundred thousand keys that chance is below 1e-8.
+#
+# With adw_env["persist_news_digests"] the index is kept between runs in
+#   data-lake/raw-data/_manifests/news.digests.parquet
+# and only rows newer than the persisted window are queried. Digests older than retention_days are
+# pruned on save. Only keys of committed batches are added, so a stale index can only miss duplicates,
+# never hide a row that is not in the table (unless rows are deleted from News: delete the object then).
+
+SQL_NEWS_KEYS = """
+    SELECT TO_CHAR(pubDate, 'YYYY-MM-DD HH24:MI:SS'), title FROM News
+    WHERE pubDate >= TO_DATE(:1, 'YYYY-MM-DD HH24:MI:SS') AND pubDate <= TO_DATE(:2, 'YYYY-MM-DD HH24:MI:SS')"""
+
+DIGEST_SCHEMA = pa.schema([pa.field('digest', pa.uint64()), pa.field('pubDate', pa.string())])
+
+
+def key_digest(pubdate, title):
+    return int.from_bytes(hashlib.blake2b('{}\x1f{}'.format(pubdate, title).encode(), digest_size=8).digest(), 'little')
+
+
+class DigestIndex:
+    def __init__(self, OSDS=None, ingest_path=None, persist=False, retention_days=7):
+        self.OSDS = OSDS
+        self.path = manifest_path(ingest_path, '.digests.parquet') if persist else None
+        self.retention_days = retention_days
+        self.digests = {}  # digest -> pubDate, the date is only kept for pruning
+        self.covered_to = None
+
+    def read(self):
+        try:
+            response = self.OSDS.get_object(self.path)
+        except ServiceError as e:
+            if e.status == 404:
+                return
+            raise
+        table = pq.read_table(io.BytesIO(response.data.content))
+        self.digests = dict(zip(table['digest'].to_pylist(), table['pubDate'].to_pylist()))
+        self.covered_to = (table.schema.metadata or {}).get(b'covered_to', b'').decode() or None
+
+    def load(self, connection, from_date, to_date):
+        # from_date/to_date: 'YYYY-MM-DD HH:MM:SS' bounds of the rows about to be loaded. Called once per
+        # group of objects OS2ADW loads; the persisted index is read on the first call only
+        if self.path and self.covered_to is None:
+            self.read()
+        if self.covered_to and self.covered_to >= to_date:
+            return 0
+        query_from = max(from_date, self.covered_to) if self.covered_to else from_date
+        with connection.cursor() as cursor:
+            cursor.arraysize = 10000
+            cursor.execute(SQL_NEWS_KEYS, [query_from, to_date])
+            rows = cursor.fetchall()
+        for pubdate, title in rows:
+            self.digests[key_digest(pubdate, title)] = pubdate
+        self.covered_to = max(self.covered_to or to_date, to_date)
+        return len(rows)
+
+    def table_digests(self, table):
+        return [key_digest(p, t) for p, t in zip(table['pubDate'].to_pylist(), table['title'].to_pylist())]
+
+    def filter(self, table):
+        # returns (rows not known to be loaded, number of rows dropped)
+        known = pa.array([d in self.digests for d in self.table_digests(table)], pa.bool_())
+        return table.filter(pc.invert(known)), pc.sum(known).as_py() or 0
+
+    def add(self, table):
+        for digest, pubdate in zip(self.table_digests(table), table['pubDate'].to_pylist()):
+            self.digests[digest] = pubdate
+
+    def save(self):
+        if not self.path or self.covered_to is None:
+            return
+        cutoff = (datetime.datetime.strptime(self.covered_to, '%Y-%m-%d %H:%M:%S')
+                  - datetime.timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        kept = [(d, p) for d, p in self.digests.items() if p >= cutoff]
+        table = pa.Table.from_arrays([pa.array([d for d, _ in kept], pa.uint64()), pa.array([p for _, p in kept], pa.string())],
+                                     schema=DIGEST_SCHEMA.with_metadata({'covered_to': self.covered_to}))
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        self.OSDS.create_object(sink.getvalue().to_pybytes(), self.path)
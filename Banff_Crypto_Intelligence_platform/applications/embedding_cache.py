@@ -0,0 +1,108 @@
+import hashlib
+import io
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from oci.exceptions import ServiceError
+
+from embeddings import DEFAULT_CACHE_DIR, EMBEDDING_SIZE
+from watermark import manifest_path
+
+
+# Content-addressed cache of news embeddings. The feature job re-reads the last 48 hours of News every
+# hour, so almost every article was already encoded by an earlier run. Vectors are keyed by a 128-bit
+# digest of the model identity and the cleaned text, so a changed text, cleaning rule or model simply
+# misses; a stale copy of the cache can cost encoding time, never a wrong vector.
+#
+# The cache is one parquet file, kept in the local cache directory (adw_env["model_cache_dir"]) and in
+#   data-lake/raw-data/_manifests/news.embeddings.parquet   (next to the ingest manifests of ND_ingest_path)
+# The local copy is read when present, the object otherwise; save() writes both. Entries not used for
+# retention_days (adw_env["embedding_cache_days"], default 7) are evicted on save.
+
+CACHE_FILE = 'news.embeddings.parquet'
+
+CACHE_SCHEMA = pa.schema([pa.field('key', pa.binary(16)),
+                          pa.field('last_used', pa.int64()),
+                          pa.field('embedding', pa.list_(pa.float32(), EMBEDDING_SIZE))])
+
+
+class EmbeddingCache:
+    def __init__(self, OSDS=None, ingest_path=None, local_dir=None, model_id='', retention_days=7):
+        self.OSDS = OSDS
+        self.path = manifest_path(ingest_path, '.embeddings.parquet') if ingest_path else None
+        self.local_path = os.path.join(local_dir or DEFAULT_CACHE_DIR, CACHE_FILE)
+        self.model_id = model_id
+        self.retention_days = retention_days
+        self.rows = {}  # key -> row of vectors
+        self.vectors = np.empty((0, EMBEDDING_SIZE), np.float32)
+        self.last_used = np.empty(0, np.int64)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        return hashlib.blake2b('{}\x1f{}'.format(self.model_id, text).encode(), digest_size=16).digest()
+
+    def read(self):
+        content = None
+        if os.path.exists(self.local_path):
+            with open(self.local_path, 'rb') as f:
+                content = f.read()
+        elif self.path:
+            try:
+                content = self.OSDS.get_object(self.path).data.content
+            except ServiceError as e:
+                if e.status != 404:
+                    raise
+        if content is None:
+            return
+        table = pq.read_table(io.BytesIO(content))
+        self.rows = {key: i for i, key in enumerate(table['key'].to_pylist())}
+        self.vectors = table['embedding'].combine_chunks().flatten().to_numpy().reshape(-1, EMBEDDING_SIZE).copy()
+        self.last_used = table['last_used'].to_numpy().copy()
+        print("EmbeddingCache: {} vectors read".format(len(self.rows)))
+
+    def encode(self, encoder, texts):
+        # texts: cleaned article texts -> float32 array (len(texts), 768); only unseen texts reach the encoder
+        keys = [self.key(text) for text in texts]
+        rows = np.array([self.rows.get(key, -1) for key in keys], np.int64)
+        missing = {}  # key -> index of its first text, so a text repeated in the batch is encoded once
+        for i in np.flatnonzero(rows < 0):
+            missing.setdefault(keys[i], i)
+        if missing:
+            encoded = encoder.encode([texts[i] for i in missing.values()])
+            first = len(self.vectors)
+            self.vectors = np.concatenate([self.vectors, encoded])
+            self.last_used = np.concatenate([self.last_used, np.zeros(len(encoded), np.int64)])
+            for offset, key in enumerate(missing):
+                self.rows[key] = first + offset
+            rows = np.array([self.rows[key] for key in keys], np.int64)
+        self.last_used[rows] = int(time.time())
+        hits = sum(key not in missing for key in keys)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        print("EmbeddingCache: {} hits, {} misses ({} texts encoded)".format(hits, len(texts) - hits, len(missing)))
+        return self.vectors[rows]
+
+    def save(self):
+        keep = np.flatnonzero(self.last_used >= int(time.time()) - self.retention_days * 24 * 60 * 60)
+        keys_by_row = [None] * len(self.vectors)
+        for key, row in self.rows.items():
+            keys_by_row[row] = key
+        vectors = self.vectors[keep]
+        table = pa.Table.from_arrays([pa.array([keys_by_row[i] for i in keep], pa.binary(16)),
+                                      pa.array(self.last_used[keep], pa.int64()),
+                                      pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel(), pa.float32()),
+                                                                        EMBEDDING_SIZE)],
+                                     schema=CACHE_SCHEMA)
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        content = sink.getvalue().to_pybytes()
+        os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+        with open(self.local_path, 'wb') as f:
+            f.write(content)
+        if self.path:
+            self.OSDS.create_object(content, self.path)
+        print("EmbeddingCache: {} vectors saved, {} evicted".format(len(keep), len(self.vectors) - len(keep)))
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+# BERT encoder for the news feature jobs (ADW_Feature_Extraction*.py). The tokenizer and the model are
+# loaded once per process, on the first encode(), from an explicit cache directory, and reused for every
+# article; loading them used to happen per article and dominated the run. Use get_encoder() rather than
+# building a NewsEncoder, so every caller in the process shares the loaded model.
+#
+# The cache directory comes from adw_env["model_cache_dir"] (default: <tmp>/bert-cache); point it at a
+# persistent volume to avoid downloading the weights again on every job start.
+#
+# Texts are tokenized in one call to the fast (Rust) tokenizer, sorted by token length and run through
+# the model in batches of adw_env["embedding_batch_size"] (default 32), each padded to its longest text
+# instead of to 512 tokens. benchmarks/bench_embeddings.py measures the throughput per batch size.
+
+MODEL_NAME = 'bert-base-cased'
+EMBEDDING_SIZE = 768
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'bert-cache')
+DEFAULT_BATCH_SIZE = 32
+
+
+class NewsEncoder:
+    def __init__(self, model_name=MODEL_NAME, cache_dir=None, max_length=512, batch_size=DEFAULT_BATCH_SIZE):
+        self.model_name = model_name
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_length = max_length
+        self.batch_size = batch_size
+        # what the vectors depend on besides the text; part of the embedding cache key
+        self.model_id = '{}:{}'.format(model_name, max_length)
+        self.tokenizer = None
+        self.model = None
+        self.lock = threading.Lock()
+        self.load_seconds = 0.0
+        self.tokenize_seconds = 0.0
+        self.encode_seconds = 0.0
+        self.encoded = 0
+
+    def load(self):
+        with self.lock:
+            if self.model is not None:
+                return
+            started = time.perf_counter()
+            # imported here: tensorflow alone takes seconds, and only the first encode() needs it
+            from transformers import BertTokenizerFast, TFBertModel
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.tokenizer = BertTokenizerFast.from_pretrained(self.model_name, cache_dir=self.cache_dir)
+            self.model = TFBertModel.from_pretrained(self.model_name, cache_dir=self.cache_dir)
+            self.load_seconds = time.perf_counter() - started
+            print("NewsEncoder: loaded {} from {} in {:.1f} s".format(self.model_name, self.cache_dir, self.load_seconds))
+
+    def encode(self, texts, batch_size=None):
+        # texts: cleaned article texts -> float32 array (len(texts), 768), the pooled output per text, in input order
+        self.load()
+        batch_size = batch_size or self.batch_size
+        out = np.empty((len(texts), EMBEDDING_SIZE), np.float32)
+        if not texts:
+            return out
+        started = time.perf_counter()
+        # one call into the Rust tokenizer for the whole list; no padding yet
+        input_ids = self.tokenizer(list(texts), max_length=self.max_length, truncation=True, add_special_tokens=True,
+                                   return_attention_mask=False, return_token_type_ids=False)['input_ids']
+        lengths = np.array([len(ids) for ids in input_ids])
+        tokenized = time.perf_counter()
+        # texts of similar length share a batch, which is padded only to its longest member; the attention
+        # mask keeps the padding out of the result, so each vector is the one the text gets on its own
+        order = np.argsort(lengths, kind='stable')
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            width = lengths[batch].max()
+            ids = np.full((len(batch), width), self.tokenizer.pad_token_id, np.int32)
+            mask = np.zeros((len(batch), width), np.int32)
+            for row, i in enumerate(batch):
+                ids[row, :lengths[i]] = input_ids[i]
+                mask[row, :lengths[i]] = 1
+            pooled = self.model({'input_ids': ids, 'attention_mask': mask}, training=False)[1]
+            out[batch] = pooled.numpy()
+        self.tokenize_seconds += tokenized - started
+        self.encode_seconds += time.perf_counter() - started
+        self.encoded += len(texts)
+        return out
+
+    def report(self, label):
+        per_article = 1000 * self.encode_seconds / self.encoded if self.encoded else 0.0
+        print("{}: model load {:.1f} s, {} articles encoded in {:.1f} s ({:.1f} ms/article, tokenizing {:.1f} s)".format(
+            label, self.load_seconds, self.encoded, self.encode_seconds, per_article, self.tokenize_seconds))
+
+
+def embedding_columns(size=EMBEDDING_SIZE):
+    # FEATURES column names of the mean embedding: EMBD1..EMBD768
+    return ['EMBD{}'.format(i + 1) for i in range(size)]
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder(cache_dir=None, batch_size=DEFAULT_BATCH_SIZE):
+    # one encoder per process; the first caller's settings win
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = NewsEncoder(cache_dir=cache_dir, batch_size=batch_size)
+        return _encoder
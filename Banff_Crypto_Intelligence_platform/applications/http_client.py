@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Shared HTTP client for the API jobs (CoinWatch, NewsData, model deployment /predict).
+# Ship this file next to the application scripts (archive.zip) and use get_client()
+# instead of bare requests.get/requests.post, so connections are kept alive between calls.
+
+JSON_DECODERS = {"json": json.loads}
+if orjson is not None:
+    JSON_DECODERS["orjson"] = orjson.loads
+
+# statuses worth another attempt; urllib3 retries them for GET/HEAD only, POSTs are retried by post_json
+# and only when the caller declares them idempotent
+RETRY_STATUSES = (429,500,502,503,504)
+
+DEFAULT_HEADERS = {
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+
+class TokenBucket:
+    # thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`
+    def __init__(self,rate,capacity):
+        self.rate=rate
+        self.capacity=capacity
+        self.tokens=capacity
+        self.updated=time.monotonic()
+        self.lock=threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now=time.monotonic()
+                self.tokens=min(self.capacity,self.tokens+(now-self.updated)*self.rate)
+                self.updated=now
+                if self.tokens>=1:
+                    self.tokens-=1
+                    return
+                wait=(1-self.tokens)/self.rate
+            time.sleep(wait)
+
+
+class BudgetSpent(Exception):
+    # raised by a request made after the run's RequestBudget is used up
+    pass
+
+
+class RequestBudget:
+    # caps the number of API calls a single run may make (None: unlimited)
+    def __init__(self,max_requests=None):
+        self.remaining=max_requests
+        self.used=0
+        self.lock=threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.remaining is not None:
+                if self.remaining<=0:
+                    return False
+                self.remaining-=1
+            self.used+=1
+            return True
+
+
+class HttpClient:
+    def __init__(self,
+                 json_decoder="orjson",
+                 pool_connections=4,
+                 pool_maxsize=8,
+                 timeout=30,
+                 retries=3,
+                 backoff_factor=0.5):
+        # fall back to the stdlib decoder when orjson is not installed in the job image
+        self.loads=JSON_DECODERS.get(json_decoder,json.loads)
+        self.timeout=timeout
+        self.retries=retries
+        self.backoff_factor=backoff_factor
+
+        # retries inside urllib3 bypass the callers' rate limiters and would repeat POSTs blindly,
+        # so they are limited to idempotent reads
+        retry=Retry(total=retries,
+                    backoff_factor=backoff_factor,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(["GET","HEAD"]),
+                    respect_retry_after_header=True,
+                    raise_on_status=False)
+        # pool_maxsize is the per-host connection limit; pool_block makes extra threads wait
+        # for a free connection instead of opening (and then discarding) new ones
+        adapter=HTTPAdapter(pool_connections=pool_connections,
+                            pool_maxsize=pool_maxsize,
+                            pool_block=True,
+                            max_retries=retry)
+        self.session=requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount("https://",adapter)
+        self.session.mount("http://",adapter)
+
+    def request(self,method,url,**kwargs):
+        kwargs.setdefault("timeout",self.timeout)
+        return self.session.request(method,url,**kwargs)
+
+    def decode(self,response):
+        response.raise_for_status()
+        return self.loads(response.content)
+
+    def get_json(self,url,**kwargs):
+        return self.decode(self.request("GET",url,**kwargs))
+
+    def retry_wait(self,response,attempt):
+        # Retry-After (seconds) when the server sends one, exponential backoff otherwise
+        retry_after=response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff_factor*(2**attempt)
+
+    def post_json(self,url,idempotent=False,before_attempt=None,**kwargs):
+        # a POST that is really a read (CoinWatch history) passes idempotent=True to be retried on
+        # RETRY_STATUSES and connection errors; before_attempt (e.g. a TokenBucket's acquire) runs
+        # before every attempt, so retries are rate limited like first attempts
+        attempts=self.retries+1 if idempotent else 1
+        for attempt in range(attempts):
+            if before_attempt is not None:
+                before_attempt()
+            try:
+                response=self.request("POST",url,**kwargs)
+            except (requests.ConnectionError,requests.Timeout):
+                if attempt==attempts-1:
+                    raise
+                time.sleep(self.retry_wait(None,attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and attempt<attempts-1:
+                time.sleep(self.retry_wait(response,attempt))
+                continue
+            return self.decode(response)
+
+    def close(self):
+        self.session.close()
+
+
+_client=None
+_client_lock=threading.Lock()
+
+def get_client(http_env=None):
+    # one client per process; the first caller's settings win
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client=HttpClient(**(http_env or {}))
+        return _client
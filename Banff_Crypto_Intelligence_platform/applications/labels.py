@@ -0,0 +1,52 @@
+import numpy as np
+
+
+# BUY/HOLD/SELL targets of the feature jobs, for every row at once. For a row at t with rate r, the
+# change is 100 * (mean rate strictly between t and t + hours - r) / (r + 1e-6); above hold_percent is
+# BUY, below -hold_percent is SELL, anything else (including an empty window or a missing rate) is HOLD,
+# exactly like target() did per row. Rates are sorted by timestamp once and the forward means come from
+# prefix sums, so each (hours, hold_percent) configuration costs two searchsorted calls, and
+# configurations sharing a horizon share the means.
+#
+#   df_features['TARGET'] = target_label(df_features['TIMESTAMP'].values, df_features['RATE'].values, 24, 0.5)
+#   by_config = target_labels(ts, rates, [(24, 0.5), (24, 2), (6, 0.5), (72, 1)])   # {(hours, hold): labels}
+
+HOUR_MS = 60 * 60 * 1000
+
+
+def forward_changes(ts, rate, hours_list):
+    # {hours: percent change of the forward mean rate, per row in input order (NaN: empty window)}
+    ts = np.asarray(ts, np.float64)
+    rate = np.asarray(rate, np.float64)
+    order = np.argsort(ts, kind='stable')
+    ts_sorted = ts[order]
+    rate_sorted = rate[order]
+    # missing rates are left out of the means, as pandas' mean() skips them
+    known = ~np.isnan(rate_sorted)
+    total = np.concatenate([[0.0], np.cumsum(np.where(known, rate_sorted, 0.0))])
+    count = np.concatenate([[0], np.cumsum(known)])
+    # the current rate is that of the first row holding the timestamp, as target() took .values[0]
+    current = rate_sorted[np.searchsorted(ts_sorted, ts, side='left')]
+    lo = np.searchsorted(ts_sorted, ts, side='right')
+    changes = {}
+    for hours in hours_list:
+        hi = np.searchsorted(ts_sorted, ts + hours * HOUR_MS, side='left')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (total[hi] - total[lo]) / (count[hi] - count[lo])
+            changes[hours] = 100 * (mean - current) / (current + 1e-6)
+    return changes
+
+
+def label(change, hold_percent):
+    # NaN compares false both ways, so it is HOLD
+    return np.where(change > hold_percent, 'BUY', np.where(change < -hold_percent, 'SELL', 'HOLD')).astype(object)
+
+
+def target_labels(ts, rate, configs):
+    # configs: [(avg_rate_hour_after, hold_percent)] -> {(avg_rate_hour_after, hold_percent): labels}
+    changes = forward_changes(ts, rate, sorted({hours for hours, _ in configs}))
+    return {(hours, hold_percent): label(changes[hours], hold_percent) for hours, hold_percent in configs}
+
+
+def target_label(ts, rate, avg_rate_hour_after=24, hold_percent=2):
+    return target_labels(ts, rate, [(avg_rate_hour_after, hold_percent)])[(avg_rate_hour_after, hold_percent)]
@@ -0,0 +1,136 @@
+import oracledb
+
+
+# Ingest ledger: one row per object OS2ADW has loaded, with the ETag it had at the time. The listing
+# is diffed against it, so only new objects and objects whose content changed (new ETag) are fetched;
+# late files are picked up whatever their timestamps, and nothing already loaded is fetched again.
+# Only the rows of the names being looked at are read, so the ledger read stays the size of the
+# lookback listing however many objects have been loaded over time. Compacted objects get new names,
+# but when every object they were merged from is in the ledger they are recorded as loaded without
+# being fetched (row_count NULL). An object is recorded once every batch holding its rows has
+# committed; the loads themselves are idempotent MERGEs, so an object whose ledger write is lost is
+# simply merged again on the next run.
+#
+# Before loading, a run claims its objects: their ledger rows (inserted with a NULL ETag when missing)
+# are locked with SELECT ... FOR UPDATE SKIP LOCKED on a session kept until the ledger is recorded,
+# whose commit releases them. An object claimed by another run (OS2ADW_event and the hourly OS2ADW)
+# is left to it, so the same object is never merged from two sessions at once; News has no unique
+# key, and two concurrent MERGEs of the same rows would both insert them. Claim rows that were never
+# recorded (NULL ETag) do not count as loaded.
+#
+#   OS2ADW.py <env> <adw_env> --reload data-lake/raw-data/news/year=2023/month=03/
+# forces every object under the prefix to be fetched and merged again.
+
+SQL_CREATE_LEDGER = """
+    CREATE TABLE Ingest_Ledger (object_name VARCHAR2(1024) PRIMARY KEY,
+                                source VARCHAR2(16),
+                                etag VARCHAR2(256),
+                                row_count NUMBER,
+                                loaded_at TIMESTAMP)"""
+
+# names are bound LEDGER_READ_BATCH at a time (Oracle's IN list limit); the last batch is padded with
+# NULLs, which match nothing, so every batch runs the same statement
+LEDGER_READ_BATCH = 1000
+SQL_READ_LEDGER = """
+    SELECT object_name, etag FROM Ingest_Ledger
+    WHERE source = :1 AND etag IS NOT NULL AND object_name IN ({})""".format(
+    ', '.join(':{}'.format(i + 2) for i in range(LEDGER_READ_BATCH)))
+
+SQL_CLAIM_ROW = """
+    MERGE INTO Ingest_Ledger l
+    USING (SELECT :1 AS object_name, :2 AS source FROM dual) d
+    ON (l.object_name = d.object_name)
+    WHEN NOT MATCHED THEN
+        INSERT (object_name, source) VALUES (d.object_name, d.source)"""
+
+SQL_CLAIM = "SELECT object_name FROM Ingest_Ledger WHERE object_name IN ({}) FOR UPDATE SKIP LOCKED".format(
+    ', '.join(':{}'.format(i + 1) for i in range(LEDGER_READ_BATCH)))
+
+SQL_OBJECT_ETAG = "SELECT etag FROM Ingest_Ledger WHERE object_name = :1"
+
+SQL_RECORD = """
+    MERGE INTO Ingest_Ledger l
+    USING (SELECT :1 AS object_name, :2 AS source, :3 AS etag, :4 AS row_count FROM dual) d
+    ON (l.object_name = d.object_name)
+    WHEN MATCHED THEN
+        UPDATE SET l.etag = d.etag, l.row_count = d.row_count, l.loaded_at = SYSTIMESTAMP
+    WHEN NOT MATCHED THEN
+        INSERT (object_name, source, etag, row_count, loaded_at)
+        VALUES (d.object_name, d.source, d.etag, d.row_count, SYSTIMESTAMP)"""
+
+
+def reload_prefixes(argv):
+    # every "--reload <prefix>" pair of the command line
+    return [argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg == '--reload']
+
+
+def create_ledger_table(connection):
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(SQL_CREATE_LEDGER)
+        except oracledb.DatabaseError as e:
+            # ORA-00955: name is already used by an existing object
+            if e.args[0].code != 955:
+                raise
+
+
+def read_ledger(connection, source, names):
+    # object name -> ETag, for the names that have been loaded for the source
+    names = sorted(set(names))
+    ledger = {}
+    with connection.cursor() as cursor:
+        cursor.arraysize = LEDGER_READ_BATCH
+        for start in range(0, len(names), LEDGER_READ_BATCH):
+            batch = names[start:start + LEDGER_READ_BATCH]
+            cursor.execute(SQL_READ_LEDGER, [source] + batch + [None] * (LEDGER_READ_BATCH - len(batch)))
+            ledger.update(cursor.fetchall())
+    return ledger
+
+
+def claim_objects(connection, source, names):
+    # locks the ledger rows of names on this connection until it commits or rolls back; returns the set
+    # of names claimed, without those another session holds
+    names = sorted(set(names))
+    if not names:
+        return set()
+    with connection.cursor() as cursor:
+        # rows inserted by a concurrent claim fail with ORA-00001 and are simply there already
+        cursor.executemany(SQL_CLAIM_ROW, [(name, source) for name in names], batcherrors=True)
+        connection.commit()
+        claimed = set()
+        for start in range(0, len(names), LEDGER_READ_BATCH):
+            batch = names[start:start + LEDGER_READ_BATCH]
+            cursor.execute(SQL_CLAIM, batch + [None] * (LEDGER_READ_BATCH - len(batch)))
+            claimed.update(name for name, in cursor.fetchall())
+    return claimed
+
+
+def loaded_etag(connection, object_name):
+    # ETag the object had when it was loaded, None if it never was (or is only claimed)
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_OBJECT_ETAG, [object_name])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def unseen_objects(objects, ledger, reload=()):
+    return [obj for obj in objects
+            if obj.name not in ledger or ledger[obj.name] != obj.etag
+            or any(obj.name.startswith(prefix) for prefix in reload)]
+
+
+def compacted_loaded(objects, merged_from, ledger, reload=()):
+    # compacted objects (compaction manifest "merged_from") whose rows all come from objects already
+    # loaded: they bring nothing new, so they are recorded without being fetched and merged again
+    return [obj for obj in objects
+            if obj.name not in ledger and merged_from.get(obj.name)
+            and all(original in ledger for original in merged_from[obj.name])
+            and not any(obj.name.startswith(prefix) for prefix in reload)]
+
+
+def record_loaded(connection, source, loaded):
+    # loaded: [(object, row_count)]
+    if loaded:
+        with connection.cursor() as cursor:
+            cursor.executemany(SQL_RECORD, [(obj.name, source, obj.etag, rows) for obj, rows in loaded])
+        connection.commit()
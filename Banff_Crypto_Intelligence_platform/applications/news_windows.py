@@ -0,0 +1,43 @@
+import numpy as np
+
+
+# Mean news embedding over a trailing window, for every crypto timestamp of the feature jobs. News is
+# sorted by timestamp once and turned into a prefix sum of its embeddings; each window is then two
+# searchsorted bounds and one subtraction, whatever its length or the number of articles it holds.
+# Windows are open at both ends like create_content was: news strictly after t - hours and strictly
+# before t. Windows with no news are NaN, so the rows are dropped like before.
+#
+#   windows = NewsWindows(df_news['TIMESTAMP'].values, embeddings)
+#   features_24h = windows.mean(df_features['TIMESTAMP'].values, 24)
+#   by_hours = windows.means(df_features['TIMESTAMP'].values, (6, 24, 72))   # one pass over the bounds
+
+HOUR_MS = 60 * 60 * 1000
+
+
+class NewsWindows:
+    def __init__(self, news_ts, embeddings):
+        # news_ts: epoch ms per article; embeddings: float32 array (articles, 768) aligned with news_ts
+        news_ts = np.asarray(news_ts, np.float64)
+        order = np.argsort(news_ts, kind='stable')
+        self.news_ts = news_ts[order]
+        # prefix sums in float64: summing thousands of float32 vectors in float32 drifts
+        self.prefix = np.zeros((len(order) + 1, embeddings.shape[1]), np.float64)
+        np.cumsum(embeddings[order], axis=0, out=self.prefix[1:])
+
+    def mean(self, ts, hours=24):
+        # ts: epoch ms -> float32 array (len(ts), 768), NaN rows where the window holds no news
+        return self.means(ts, (hours,))[hours]
+
+    def means(self, ts, hours_list):
+        # several window lengths over the same timestamps: {hours: float32 array (len(ts), 768)}; the
+        # upper bound (just before t) is shared, only the lower bound differs per window
+        ts = np.asarray(ts, np.float64)
+        hi = np.searchsorted(self.news_ts, ts, side='left')
+        upper = self.prefix[hi]
+        out = {}
+        for hours in hours_list:
+            lo = np.searchsorted(self.news_ts, ts - hours * HOUR_MS, side='right')
+            count = (hi - lo).astype(np.float64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[hours] = ((upper - self.prefix[lo]) / count[:, None]).astype(np.float32)
+        return out
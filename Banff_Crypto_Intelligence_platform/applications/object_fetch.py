@@ -0,0 +1,95 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from watermark import OBJECT_NAME
+
+
+# Download stage for the loaders (OS2ADW): objects are fetched and decoded by a pool of threads while
+# the caller consumes them, so a run is bound by bandwidth instead of one round trip per object.
+#
+# Results are handed back in timestamp order (the <start>_<end> of the object name) whatever order
+# they finish in. Memory is bounded by a ByteBudget of decoded bytes: before a download the listed
+# object size (so the listing must be made with fields including "size"), scaled by the decoded/listed
+# ratio of the objects seen so far, is reserved; once decoded the reservation becomes table.nbytes.
+# With budget_bytes the bytes are given back as soon as a table is handed over. With a ByteBudget the
+# consumer gives table.nbytes back itself, once it no longer holds the table, so the tables it keeps
+# count too. When nothing is downloading, the next object is fetched even over budget, so one object
+# bigger than the whole budget still goes through, on its own.
+#
+#   for obj, rows in fetch_objects(make_store, objects, decode, workers=8, budget_bytes=256*1024*1024):
+#       ...
+#   budget = ByteBudget(256*1024*1024)
+#   for obj, rows in fetch_objects(make_store, objects, decode, budget=budget):
+#       ...  # budget.release(rows.nbytes) once rows are loaded
+
+
+class ByteBudget:
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes, force=False):
+        with self.lock:
+            if not force and self.used + nbytes > self.limit:
+                return False
+            self.used += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self.lock:
+            self.used -= nbytes
+
+    def full(self):
+        return self.used >= self.limit
+
+
+def timestamp_order(objects):
+    return sorted(objects, key=lambda obj: tuple(int(t) for t in OBJECT_NAME.search(obj.name).groups()))
+
+
+def fetch_objects(make_store, objects, decode, workers=8, budget_bytes=256*1024*1024, budget=None):
+    # make_store() builds an OS_Data_Store; it is called once per worker thread, since OCI clients
+    # should not be shared between threads. decode(content) -> pyarrow Table, runs in the worker as well.
+    local = threading.local()
+
+    def fetch(obj):
+        if not hasattr(local, 'store'):
+            local.store = make_store()
+        content = local.store.get_object(obj.name).data.content
+        return decode(content), len(content)
+
+    owned = budget is None
+    if owned:
+        budget = ByteBudget(budget_bytes)
+    objects = timestamp_order(objects)
+    pending = collections.deque()
+    stats = {'objects': 0, 'bytes': 0, 'decoded': 0}
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        i = 0
+        while i < len(objects) or pending:
+            # keep at most 2*workers objects queued, and stay within the byte budget
+            expansion = stats['decoded'] / stats['bytes'] if stats['bytes'] else 1.0
+            while i < len(objects) and len(pending) < 2 * workers:
+                estimate = int((objects[i].size or 0) * expansion)
+                if not budget.reserve(estimate, force=not pending):
+                    break
+                pending.append((objects[i], estimate, executor.submit(fetch, objects[i])))
+                i += 1
+            obj, estimate, future = pending.popleft()
+            table, nbytes = future.result()
+            budget.release(estimate)
+            budget.reserve(table.nbytes, force=True)
+            stats['objects'] += 1
+            stats['bytes'] += nbytes
+            stats['decoded'] += table.nbytes
+            yield obj, table
+            if owned:
+                budget.release(table.nbytes)
+    elapsed = time.monotonic() - started
+    print("fetch_objects: {} objects, {:.1f} MB in {:.1f}s ({:.1f} MB/s, {:.1f} MB decoded, {} workers)".format(
+        stats['objects'], stats['bytes'] / 1e6, elapsed, stats['bytes'] / 1e6 / max(elapsed, 1e-6),
+        stats['decoded'] / 1e6, workers))
@@ -0,0 +1,53 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from schemas import build_table
+
+
+# In-memory parquet serialization for the ingest jobs: API payloads go straight into an Arrow
+# table, get written to an Arrow buffer and are uploaded from memory, so nothing touches the
+# job container's disk. Writer settings come from an optional "parquet" entry in the source env:
+#   "parquet": {"compression": "zstd", "use_dictionary": ["currency"], "row_group_size": 65536,
+#               "multipart_threshold_mb": 64, "part_size_mb": 16}
+# The ingest jobs' per-interval and per-window objects are a few hundred KB at most and always go up
+# in a single PUT; only compaction outputs, which merge a whole partition, can reach the threshold.
+
+DEFAULT_PARQUET_ENV = {
+    "compression": "snappy",
+    "use_dictionary": True,
+    "row_group_size": None,
+    "multipart_threshold_mb": 64,
+    "part_size_mb": 16,
+}
+
+
+def parquet_settings(source_env):
+    settings = dict(DEFAULT_PARQUET_ENV)
+    settings.update(source_env.get("parquet") or {})
+    return settings
+
+
+def records_to_table(records, schema=None):
+    # with a schema (schemas.CW_SCHEMA / ND_SCHEMA) the records are validated and typed up front
+    if schema is not None:
+        return build_table(records, schema)
+    return pa.Table.from_pylist(records)
+
+
+def table_to_buffer(table, settings):
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink,
+                   compression=settings["compression"],
+                   use_dictionary=settings["use_dictionary"],
+                   row_group_size=settings["row_group_size"])
+    return sink.getvalue()
+
+
+def upload_table(OSDS, table, path, settings):
+    # small objects go up in a single PUT, large (compacted) files through the multipart upload manager
+    buf = table_to_buffer(table, settings)
+    if buf.size >= settings["multipart_threshold_mb"] * 1024 * 1024:
+        OSDS.upload_stream(pa.BufferReader(buf), path, part_size=settings["part_size_mb"] * 1024 * 1024)
+    else:
+        OSDS.create_object(buf.to_pybytes(), path)
+    return buf.size
@@ -0,0 +1,67 @@
+import datetime
+
+from watermark import OBJECT_NAME
+
+
+# Hive-style time partitioning of the ingest prefixes. Objects are written under the UTC hour their
+# window starts in:
+#   data-lake/raw-data/crypto/year=2023/month=03/day=01/hour=08/rc1677680000_1677657600_1677686400.parquet
+# and readers list only the partitions covering the time range they need (list_partitions), instead
+# of the whole prefix. Compacted objects sit at day or month level with a "compacted_" name prefix.
+# Both OS_Data_Store.list_object and utils.OSDataSource.list_object can be used for listing.
+
+
+def _utc(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+
+
+def month_prefix(ingest_path, ts):
+    t = _utc(ts)
+    return '{}/year={:04d}/month={:02d}/'.format(ingest_path.rstrip('/'), t.year, t.month)
+
+
+def day_prefix(ingest_path, ts):
+    return '{}day={:02d}/'.format(month_prefix(ingest_path, ts), _utc(ts).day)
+
+
+def hour_prefix(ingest_path, ts):
+    return '{}hour={:02d}/'.format(day_prefix(ingest_path, ts), _utc(ts).hour)
+
+
+def object_path(ingest_path, filename):
+    # rc<ingest>_<start>_<end>.parquet -> partition of <start>
+    start = int(OBJECT_NAME.search(filename).group(1))
+    return hour_prefix(ingest_path, start) + filename
+
+
+def covering_prefixes(ingest_path, from_ts, to_ts):
+    # whole months inside [from_ts, to_ts] are listed with one month prefix; partially covered
+    # months are listed day by day, plus their month-level compacted objects
+    first = _utc(from_ts).date()
+    last = _utc(to_ts).date()
+    prefixes = []
+    day = first
+    while day <= last:
+        month_start = day.replace(day=1)
+        next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+        ts = int(datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp())
+        if month_start >= first and next_month - datetime.timedelta(days=1) <= last:
+            prefixes.append(month_prefix(ingest_path, ts))
+            day = next_month
+            continue
+        if day == first or day.day == 1:
+            prefixes.append(month_prefix(ingest_path, ts) + 'compacted_')
+        prefixes.append(day_prefix(ingest_path, ts))
+        day += datetime.timedelta(days=1)
+    return prefixes
+
+
+def list_partitions(OSDS, ingest_path, from_ts, to_ts, legacy_prefix=None):
+    # from_ts/to_ts in epoch seconds. legacy_prefix ('rc'/'rn') also picks up objects written
+    # flat under the ingest path before the partitioned layout.
+    objects = []
+    for prefix in covering_prefixes(ingest_path, from_ts, to_ts):
+        objects += OSDS.list_object(prefix)
+    if legacy_prefix:
+        objects += OSDS.list_object('{}/{}'.format(ingest_path.rstrip('/'), legacy_prefix))
+    return objects
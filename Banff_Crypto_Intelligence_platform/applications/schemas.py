@@ -0,0 +1,85 @@
+import re
+
+import pyarrow as pa
+
+
+# Fixed Arrow schemas of the raw ingest files. Records from the API JSON are turned column by column
+# into typed Arrow arrays (no pandas type inference), so the same column has the same type in every
+# file, e.g. liquidity is always float64 and keywords always list<string>, whatever one window
+# happened to contain. A payload that does not fit the schema raises SchemaError and is not written.
+#
+# Fields not in the schema are dropped; non-nullable fields must be present in every record.
+
+CW_SCHEMA = pa.schema([
+    pa.field('date', pa.int64(), nullable=False),          # epoch milliseconds
+    pa.field('rate', pa.float64(), nullable=False),
+    pa.field('volume', pa.float64()),
+    pa.field('cap', pa.float64()),
+    pa.field('liquidity', pa.float64()),
+], metadata={'source': 'livecoinwatch', 'schema_version': '1'})
+
+ND_SCHEMA = pa.schema([
+    pa.field('title', pa.string(), nullable=False),
+    pa.field('link', pa.string(), nullable=False),
+    pa.field('keywords', pa.list_(pa.string())),
+    pa.field('creator', pa.list_(pa.string())),
+    pa.field('video_url', pa.string()),
+    pa.field('description', pa.string()),
+    pa.field('content', pa.string()),
+    pa.field('pubDate', pa.string(), nullable=False),      # 'YYYY-MM-DD HH:MM:SS', as served by newsdata.io
+    pa.field('image_url', pa.string()),
+    pa.field('source_id', pa.string()),
+    pa.field('category', pa.list_(pa.string())),
+    pa.field('country', pa.list_(pa.string())),
+    pa.field('language', pa.string()),
+], metadata={'source': 'newsdata.io', 'schema_version': '1'})
+
+PUBDATE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _check(field, values):
+    # pyarrow silently truncates 1.5 to an int64 and turns 'abc' into ['a', 'b', 'c'] for a list
+    # column, so those two cases are checked by hand
+    if pa.types.is_integer(field.type):
+        bad = [v for v in values if v is not None and type(v) is not int]
+    elif pa.types.is_list(field.type):
+        bad = [v for v in values if v is not None and not isinstance(v, list)]
+    else:
+        return
+    if bad:
+        raise SchemaError("{}: expected {}, got {!r}".format(field.name, field.type, bad[0]))
+
+
+def build_table(records, schema):
+    arrays = []
+    for field in schema:
+        values = [record.get(field.name) for record in records]
+        _check(field, values)
+        try:
+            array = pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise SchemaError("{}: {}".format(field.name, e))
+        if not field.nullable and array.null_count:
+            raise SchemaError("{}: {} missing values".format(field.name, array.null_count))
+        arrays.append(array)
+    table = pa.Table.from_arrays(arrays, schema=schema)
+    if 'pubDate' in schema.names:
+        bad = [v for v in table['pubDate'].to_pylist() if not PUBDATE.match(v)]
+        if bad:
+            raise SchemaError("pubDate: unexpected format {!r}".format(bad[0]))
+    return table
+
+
+def conform(table, schema):
+    # cast a table read back from storage (e.g. a legacy, pandas-written file) to the schema
+    missing = [name for name in schema.names if name not in table.column_names]
+    for name in missing:
+        table = table.append_column(name, pa.nulls(table.num_rows, schema.field(name).type))
+    try:
+        return table.select(schema.names).cast(schema)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise SchemaError(str(e))
@@ -13,7 +13,7 @@ import tempfile
 import datetime
 import time
 
-import requests
+from http_client import get_client
 
 
 
@@ -152,19 +152,20 @@ def main():
     # 
     # ask for prediction
     auth = oci.auth.signers.get_resource_principals_signer()
+    client = get_client(adw_env.get("http_client"))
     endpoints=get_endpoint(pool)
     
     # I look at the last URL, if did not work, use previous URL
     try:
         endpoint=endpoints[0]+'/predict'
-        pred=requests.post(endpoint, json=body, auth=auth).json()
+        pred=client.post_json(endpoint, json=body, auth=auth)
         # save to adw
         model_result_to_adw(pool,df_last_row,pred,endpoint)
     
     except Exception as e:
         print("Latest URL does not work, moving to previous URL", e)
         endpoint=endpoints[1]+'/predict'
-        pred=requests.post(endpoint, json=body, auth=auth).json()
+        pred=client.post_json(endpoint, json=body, auth=auth)
         # save to adw
         model_result_to_adw(pool,df_last_row,pred,endpoint)
     
@@ -0,0 +1,84 @@
+import os
+import re
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from embeddings import DEFAULT_CACHE_DIR
+
+
+# Text cleaning of the news feature jobs, ahead of the BERT encoder: lowercase, drop digits, drop
+# punctuation, drop English stopwords. The regex and translation table are compiled once at import and
+# the stopwords are read once per process into a frozenset; the old per-word stopwords.words('english')
+# call re-read the list and scanned it for every word of every article.
+#
+# Nothing is downloaded at import. The stopword list is read from the NLTK data path and fetched only if
+# it is missing there, into <model_cache_dir>/nltk_data, so a persistent cache directory makes that a
+# one-time download.
+#
+# Large inputs (at least min_parallel texts) are split across `workers` processes
+# (adw_env["normalize_workers"], default 1). Per-stage seconds are printed; with workers they are the
+# sum over the processes.
+
+DIGITS = re.compile(r'\d+')
+PUNCTUATION = str.maketrans('', '', string.punctuation)
+STAGES = ('lower', 'digits', 'punctuation', 'stopwords')
+
+_stopwords = None
+
+
+def stopword_set(cache_dir=None):
+    global _stopwords
+    if _stopwords is None:
+        import nltk
+        from nltk.corpus import stopwords
+        data_dir = os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'nltk_data')
+        if data_dir not in nltk.data.path:
+            nltk.data.path.append(data_dir)
+        try:
+            words = stopwords.words('english')
+        except LookupError:
+            nltk.download('stopwords', download_dir=data_dir, quiet=True)
+            words = stopwords.words('english')
+        _stopwords = frozenset(words)
+    return _stopwords
+
+
+def normalize_chunk(texts, cache_dir=None):
+    # texts -> (cleaned texts, {stage: seconds})
+    timings = {}
+    series = pd.Series(texts, dtype=object)
+    started = time.perf_counter()
+    series = series.str.lower()
+    timings['lower'] = time.perf_counter() - started
+    started = time.perf_counter()
+    series = series.str.replace(DIGITS, '', regex=True)
+    timings['digits'] = time.perf_counter() - started
+    started = time.perf_counter()
+    series = series.str.translate(PUNCTUATION)
+    timings['punctuation'] = time.perf_counter() - started
+    started = time.perf_counter()
+    stop = stopword_set(cache_dir)
+    cleaned = [' '.join([word for word in text.split() if word not in stop]) for text in series]
+    timings['stopwords'] = time.perf_counter() - started
+    return cleaned, timings
+
+
+def normalize_series(series, workers=1, min_parallel=5000, cache_dir=None, label="normalize"):
+    # pandas Series of raw texts -> Series of cleaned texts with the same index
+    texts = series.tolist()
+    started = time.perf_counter()
+    if workers > 1 and len(texts) >= min_parallel:
+        size = -(-len(texts) // workers)
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(normalize_chunk, chunks, [cache_dir] * len(chunks)))
+        cleaned = [text for chunk, _ in results for text in chunk]
+        timings = {stage: sum(t[stage] for _, t in results) for stage in STAGES}
+    else:
+        cleaned, timings = normalize_chunk(texts, cache_dir)
+    print("{}: {} texts in {:.2f} s ({})".format(label, len(texts), time.perf_counter() - started,
+                                                 ', '.join('{} {:.2f} s'.format(s, timings[s]) for s in STAGES)))
+    return pd.Series(cleaned, index=series.index, dtype=object)
@@ -0,0 +1,101 @@
+import datetime
+import io
+import json
+import posixpath
+import re
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from oci.exceptions import ServiceError
+
+
+# Per-source ingestion watermark. Instead of listing the whole ingest prefix and downloading the
+# last parquet file on every start, each ingest job keeps a small JSON object with the newest
+# timestamp it has uploaded. It lives outside the ingest prefix so listings (and OS2ADW) never see it:
+#   data-lake/raw-data/crypto  ->  data-lake/raw-data/_manifests/crypto.json
+
+OBJECT_NAME = re.compile(r"(\d{10})_(\d{10})\.parquet$")
+
+
+def manifest_path(ingest_path, suffix='.json'):
+    ingest_path = ingest_path.rstrip('/')
+    return posixpath.join(posixpath.dirname(ingest_path), '_manifests', posixpath.basename(ingest_path) + suffix)
+
+
+class Watermark:
+    def __init__(self, OSDS, ingest_path, column, path=None):
+        # column: the parquet column holding the record time ('date' for crypto, 'pubDate' for news)
+        self.OSDS = OSDS
+        self.ingest_path = ingest_path
+        self.column = column
+        self.path = path or manifest_path(ingest_path)
+        self.etag = None
+        self.manifest = None
+
+    def read(self):
+        try:
+            response = self.OSDS.get_object(self.path)
+        except ServiceError as e:
+            if e.status == 404:
+                return None
+            raise
+        self.etag = response.headers.get('etag')
+        self.manifest = json.loads(response.data.content)
+        return self.manifest
+
+    def write(self, manifest):
+        # Object Storage PUTs are atomic; if-match/if-none-match turn this into a compare-and-swap
+        # so two runs overlapping in time cannot silently roll the watermark back.
+        if self.etag:
+            response = self.OSDS.create_object(json.dumps(manifest), self.path, if_match=self.etag)
+        else:
+            response = self.OSDS.create_object(json.dumps(manifest), self.path, if_none_match='*')
+        self.etag = response.headers.get('etag')
+        self.manifest = manifest
+        return manifest
+
+    def last_timestamp(self):
+        manifest = self.read()
+        if manifest is None:
+            manifest = self.rebuild()
+        return manifest['last_timestamp'] if manifest else None
+
+    def advance(self, object_name, last_timestamp):
+        manifest = dict(self.manifest or {})
+        manifest.pop('rebuilt', None)
+        manifest.update({
+            'ingest_path': self.ingest_path,
+            'last_object': object_name,
+            'last_timestamp': last_timestamp,
+            'objects': manifest.get('objects', 0) + 1,
+            'updated_at': datetime.datetime.utcnow().isoformat(),
+        })
+        return self.write(manifest)
+
+    def rebuild(self):
+        # Slow path, used when the manifest is lost: one full listing plus one download, the same
+        # work every start used to do.
+        objects = [obj for obj in self.OSDS.list_object(self.ingest_path) if OBJECT_NAME.search(obj.name)]
+        if not objects:
+            return None
+        # newest interval first; skip windows that came back empty
+        objects.sort(key=lambda obj: OBJECT_NAME.search(obj.name).groups()[::-1], reverse=True)
+        for latest in objects:
+            get_object_response = self.OSDS.get_object(latest.name)
+            parquet_table = pq.read_table(io.BytesIO(get_object_response.data.content))
+            if parquet_table.num_rows and self.column in parquet_table.column_names:
+                break
+        else:
+            return None
+        self.read()
+        manifest = {
+            'ingest_path': self.ingest_path,
+            'last_object': latest.name,
+            # NewsData pages come newest first, so the last row is not the latest; the max is (crypto dates
+            # are epoch ms, news pubDates 'YYYY-MM-DD HH:MM:SS', both order as they compare)
+            'last_timestamp': pc.max(parquet_table[self.column]).as_py(),
+            'objects': len(objects),
+            'updated_at': datetime.datetime.utcnow().isoformat(),
+            'rebuilt': True,
+        }
+        return self.write(manifest)
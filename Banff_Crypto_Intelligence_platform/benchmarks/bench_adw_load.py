@@ -0,0 +1,84 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import oracledb
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+from adw_load import CRYPTO_LOAD_SCHEMA, NEWS_LOAD_SCHEMA, create_staging_tables, load_crypto, load_news
+
+# Rows/sec of the two OS2ADW load modes ("merge": one MERGE FROM dual per row, "staging": array insert
+# into a temporary table plus one set-based MERGE) against a real ADW instance. The loads commit chunk
+# by chunk, so the synthetic rows use timestamps far in the future (year 2100) and are deleted again
+# after every run; a fraction of them are duplicated to exercise the dedupe.
+#
+#   python benchmarks/bench_adw_load.py --user ADMIN --password ... --dsn banff_low --config-dir ~/wallet --rows 10000
+
+
+def synthetic_crypto(n, duplicates):
+    start = 4102444800000  # 2100-01-01, clear of any real data
+    data = [{"date": start + i * 60000, "rate": 30000 + random.random() * 1000, "volume": float(random.randint(1, 10**10)),
+             "cap": float(random.randint(1, 10**12)), "liquidity": random.random() * 10**8} for i in range(n)]
+    return pa.Table.from_pylist(data + random.sample(data, int(n * duplicates)), schema=CRYPTO_LOAD_SCHEMA)
+
+
+def synthetic_news(n, duplicates):
+    data = []
+    for i in range(n):
+        pubdate = "2100-01-{:02d} {:02d}:{:02d}:{:02d}".format(1 + i // 86400 % 28, i // 3600 % 24, i // 60 % 60, i % 60)
+        data.append({"pubDate": pubdate, "title": "Synthetic headline {}".format(i), "link": "https://example.com/{}".format(i),
+                     "keywords": ["bitcoin", "crypto"], "creator": ["Reporter"], "video_url": None,
+                     "description": "Description " * 20, "content": "Content " * 400, "image_url": None,
+                     "source_id": "example", "category": ["business"], "country": ["united states of america"],
+                     "language": "english"})
+    return pa.Table.from_pylist(data + random.sample(data, int(n * duplicates)), schema=NEWS_LOAD_SCHEMA)
+
+
+CLEANUP = {"Crypto": "DELETE FROM Crypto WHERE timestamp >= 4102444800000",
+           "News": "DELETE FROM News WHERE pubDate >= DATE '2100-01-01'"}
+
+
+def timed_load(connection, name, load, table, load_mode):
+    started = time.perf_counter()
+    chunks, _ = load(connection, table, load_mode)
+    elapsed = time.perf_counter() - started
+    with connection.cursor() as cursor:
+        cursor.execute(CLEANUP[name])
+    connection.commit()
+    return sum(chunk["inserted"] for chunk in chunks), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--config-dir", default=None)
+    parser.add_argument("--wallet-password", default=None)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--duplicates", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    connection = oracledb.connect(user=args.user, password=args.password, dsn=args.dsn,
+                                  config_dir=args.config_dir, wallet_location=args.config_dir,
+                                  wallet_password=args.wallet_password)
+    create_staging_tables(connection)
+
+    tables = [("Crypto", load_crypto, synthetic_crypto(args.rows, args.duplicates)),
+              ("News", load_news, synthetic_news(args.rows, args.duplicates))]
+    print("{:<8} {:<8} {:>8} {:>8} {:>10} {:>12}".format("table", "mode", "rows", "merged", "best s", "rows/s"))
+    for name, load, table in tables:
+        for load_mode in ("merge", "staging"):
+            runs = [timed_load(connection, name, load, table, load_mode) for _ in range(args.repeat)]
+            merged = runs[0][0]
+            best = min(elapsed for _, elapsed in runs)
+            print("{:<8} {:<8} {:>8} {:>8} {:>10.2f} {:>12.0f}".format(name, load_mode, table.num_rows, merged, best, table.num_rows / best))
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import io
+import math
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+from adw_load import CRYPTO_BINDS, DEFAULT_CHUNK_ROWS, NEWS_BINDS, bind_chunks, read_crypto, read_news
+from schemas import CW_SCHEMA, ND_SCHEMA
+
+# CPU time and peak memory of turning parquet objects into executemany bind rows: the pandas path
+# OS2ADW used to take (to_pandas, where/fillna, values.tolist, per-cell casts) against the Arrow bind
+# path in adw_load. No database is needed; each measurement runs in a fresh process so its peak RSS
+# is its own.
+#
+#   python benchmarks/bench_bind_path.py --rows 100000 --files 20
+
+
+def synthetic_files(source, rows, files):
+    per_file = rows // files
+    out = []
+    for f in range(files):
+        records = []
+        for i in range(f * per_file, (f + 1) * per_file):
+            if source == "crypto":
+                records.append({"date": 1677628800000 + i * 60000, "rate": 30000 + random.random() * 1000,
+                                "volume": float(random.randint(1, 10**10)), "cap": float(random.randint(1, 10**12)),
+                                "liquidity": random.random() * 10**8 if i % 10 else float("nan")})
+            else:
+                records.append({"title": "Synthetic headline {}".format(i), "link": "https://example.com/{}".format(i),
+                                "keywords": ["bitcoin", "crypto"], "creator": ["Reporter"], "video_url": None,
+                                "description": "Description " * 20, "content": "Content " * 400,
+                                "pubDate": "2023-03-01 {:02d}:{:02d}:{:02d}".format(i // 3600 % 24, i // 60 % 60, i % 60),
+                                "image_url": None, "source_id": "example", "category": ["business"],
+                                "country": ["united states of america"], "language": "english"})
+        table = pa.Table.from_pylist(records, schema=CW_SCHEMA if source == "crypto" else ND_SCHEMA)
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        out.append(sink.getvalue().to_pybytes())
+    return out
+
+
+def pandas_path(source, files):
+    # what OS2ADW did before the Arrow bind path
+    data = []
+    for content in files:
+        df = pq.read_table(io.BytesIO(content)).to_pandas()
+        if source == "crypto":
+            df = df.where(pd.notnull(df), None)
+            data += df[['date', 'rate', 'volume', 'cap', 'liquidity']].values.tolist()
+        else:
+            df = df.fillna('')
+            data += df[['pubDate', 'title', 'link', 'keywords', 'creator', 'video_url', 'description',
+                        'content', 'image_url', 'source_id', 'category', 'country', 'language']].values.tolist()
+    if source == "crypto":
+        rows = [(int(row[0]) if row[0] is not None else None,
+                 float(row[1]) if row[1] is not None else None,
+                 int(row[2]) if row[2] is not None else None,
+                 int(row[3]) if row[3] is not None else None,
+                 float(row[4]) if row[4] is not None and not math.isnan(row[4]) else None) for row in data]
+    else:
+        rows = [(str(row[0]), str(row[1]), str(row[2]), str(row[3]), str(row[4]), str(row[5]),
+                 row[6][:4000] if row[6] is not None else None,
+                 row[7][:4000] if row[7] is not None else None,
+                 str(row[8]), str(row[9]), str(row[10]), str(row[11]), str(row[12])) for row in data]
+    return len(rows)
+
+
+def arrow_path(source, files, chunk_rows=DEFAULT_CHUNK_ROWS):
+    read, binds = (read_crypto, CRYPTO_BINDS) if source == "crypto" else (read_news, NEWS_BINDS)
+    table = pa.concat_tables([read(content) for content in files])
+    return sum(len(rows) for rows in bind_chunks(table, binds, chunk_rows))
+
+
+def measure(path, source, files, queue):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.process_time()
+    rows = path(source, files)
+    cpu = time.process_time() - started
+    queue.put((rows, cpu, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024))
+
+
+def run(path, source, files):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(path, source, files, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--files", type=int, default=20)
+    args = parser.parse_args()
+
+    print("{:<8} {:<8} {:>8} {:>18} {:>16}".format("source", "path", "rows", "cpu s / 100k rows", "peak rss +MB"))
+    for source in ("crypto", "news"):
+        files = synthetic_files(source, args.rows, args.files)
+        for name, path in (("pandas", pandas_path), ("arrow", arrow_path)):
+            rows, cpu, peak = run(path, source, files)
+            print("{:<8} {:<8} {:>8} {:>18.3f} {:>16.0f}".format(source, name, rows, cpu * 100000 / rows, peak))
+
+
+if __name__ == "__main__":
+    main()
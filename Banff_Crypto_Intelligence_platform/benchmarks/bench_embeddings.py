@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+from embeddings import NewsEncoder
+
+# Articles per second of the news embedding step on CPU: the old path (one article per model call,
+# padded to 512 tokens) against NewsEncoder.encode at several batch sizes (length-sorted batches padded
+# to their longest text). Texts are synthetic, with lengths spread like cleaned news descriptions plus
+# the occasional full article. Needs transformers and tensorflow; the weights are downloaded to
+# --cache-dir on the first run.
+#
+#   python benchmarks/bench_embeddings.py --articles 256 --batch-sizes 1,8,16,32,64
+
+WORDS = ("bitcoin ethereum price market crypto trading exchange investors rally token regulation sec etf "
+         "blockchain mining wallet surge drop analysts week billion coin volatility fund stablecoin").split()
+
+
+def synthetic_texts(articles, seed=7):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(articles):
+        # most descriptions are a few dozen words; about one in ten carries the full article body
+        words = int(rng.lognormvariate(3.5, 0.6)) if rng.random() > 0.1 else rng.randint(300, 600)
+        texts.append(' '.join(rng.choice(WORDS) for _ in range(max(words, 1))))
+    return texts
+
+
+def padded_512(encoder, texts):
+    # what get_embeddings did per article, with the model already loaded
+    out = np.empty((len(texts), 768), np.float32)
+    for i, text in enumerate(texts):
+        tokens = encoder.tokenizer.encode_plus(text, max_length=512, truncation=True, padding='max_length',
+                                               add_special_tokens=True, return_attention_mask=True,
+                                               return_token_type_ids=False, return_tensors='tf')
+        out[i] = encoder.model(tokens, training=False)[1][0].numpy()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=256)
+    parser.add_argument("--batch-sizes", default="1,8,16,32,64")
+    parser.add_argument("--cache-dir", default=None)
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.articles)
+    encoder = NewsEncoder(cache_dir=args.cache_dir)
+    encoder.load()
+    # warm-up, so graph tracing is not charged to the first measurement
+    encoder.encode(texts[:8])
+
+    print("{:<22} {:>10} {:>14} {:>16}".format("path", "seconds", "articles / s", "max |diff|"))
+    started = time.perf_counter()
+    reference = padded_512(encoder, texts)
+    seconds = time.perf_counter() - started
+    print("{:<22} {:>10.1f} {:>14.1f} {:>16}".format("padded 512, batch 1", seconds, len(texts) / seconds, "-"))
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        started = time.perf_counter()
+        vectors = encoder.encode(texts, batch_size=batch_size)
+        seconds = time.perf_counter() - started
+        print("{:<22} {:>10.1f} {:>14.1f} {:>16.2e}".format("bucketed, batch {}".format(batch_size), seconds,
+                                                              len(texts) / seconds, np.abs(vectors - reference).max()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+from ADW_Feature_Extraction import feature_rows
+from news_windows import NewsWindows
+
+# Peak memory of the feature job between the encoder output and the FEATURES insert rows: the old path
+# (a list per article, apply(pd.Series) to 768 columns, merges, values.tolist()) against the float32
+# embedding array kept next to the frames and expanded only into insert rows, a chunk at a time. The
+# encoder output is synthetic; each path runs in a fresh process so its peak RSS is its own.
+#
+#   python benchmarks/bench_feature_memory.py --articles 10000 --days 30
+
+EMBD = ['EMBD{}'.format(i + 1) for i in range(768)]
+
+
+def synthetic(articles, days):
+    rng = np.random.default_rng(7)
+    start = 1677628800000
+    crypto_ts = start + np.arange(days * 24 * 12) * 5 * 60 * 1000
+    df_crypto = pd.DataFrame({'TIMESTAMP': crypto_ts, 'RATE': 30000 + rng.random(len(crypto_ts)) * 1000,
+                              'VOLUME': rng.integers(1, 10**10, len(crypto_ts)),
+                              'CAP': rng.integers(1, 10**12, len(crypto_ts)),
+                              'LIQUIDITY': rng.random(len(crypto_ts)) * 10**8})
+    df_news = pd.DataFrame({'TIMESTAMP': np.sort(rng.integers(start, crypto_ts[-1], articles))})
+    embeddings = rng.standard_normal((articles, 768)).astype(np.float32)
+    return df_crypto, df_news, embeddings
+
+
+def old_path(df_crypto, df_news, embeddings):
+    df_news['EMBEDDINGS'] = list(embeddings)
+    df_news['EMBEDDINGS'] = df_news['EMBEDDINGS'].apply(lambda x: list(x))
+    df_temp = pd.DataFrame(df_news['EMBEDDINGS'].apply(pd.Series))
+    df_temp.columns = EMBD
+    df_news = pd.merge(df_news, df_temp, left_index=True, right_index=True)
+    df_news = df_news.drop(['EMBEDDINGS'], axis=1)
+    df_features = df_crypto.copy()
+    windows = NewsWindows(df_news['TIMESTAMP'].values, df_news[EMBD].values.astype(np.float32))
+    df_mean_embeddings = pd.DataFrame(windows.mean(df_features['TIMESTAMP'].values, 24), index=df_features.index, columns=EMBD)
+    df_features = pd.merge(df_features, df_mean_embeddings, left_index=True, right_index=True)
+    df_features['TARGET'] = 'HOLD'
+    df_features = df_features.dropna()
+    return len(df_features.values.tolist())
+
+
+def new_path(df_crypto, df_news, embeddings):
+    df_features = df_crypto.reset_index(drop=True)
+    windows = NewsWindows(df_news['TIMESTAMP'].values, embeddings)
+    mean_embeddings = windows.mean(df_features['TIMESTAMP'].values, 24)
+    df_features['TARGET'] = 'HOLD'
+    df_features = df_features[~np.isnan(mean_embeddings[:, 0])].dropna()
+    return sum(len(rows) for rows in feature_rows(df_features, mean_embeddings))
+
+
+def measure(path, articles, days, queue):
+    df_crypto, df_news, embeddings = synthetic(articles, days)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    rows = path(df_crypto, df_news, embeddings)
+    seconds = time.perf_counter() - started
+    queue.put((rows, seconds, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    print("{:<6} {:>8} {:>10} {:>16}".format("path", "rows", "seconds", "peak rss +MB"))
+    for name, path in (("old", old_path), ("new", new_path)):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(path, args.articles, args.days, queue))
+        process.start()
+        rows, seconds, peak = queue.get()
+        process.join()
+        print("{:<6} {:>8} {:>10.1f} {:>16.0f}".format(name, rows, seconds, peak))
+
+
+if __name__ == "__main__":
+    main()
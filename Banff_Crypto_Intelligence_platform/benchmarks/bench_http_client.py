@@ -0,0 +1,112 @@
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+from http_client import JSON_DECODERS, HttpClient
+
+# Per-request latency of bare requests.get/requests.post (what the jobs used to do) against the
+# pooled HttpClient, measured against a local mock of the newsdata.io archive endpoint.
+#
+#   python benchmarks/bench_http_client.py --requests 500 --articles 50
+
+
+def archive_page(n_articles):
+    article = {
+        "title": "Bitcoin rallies as markets digest rate decision",
+        "link": "https://example.com/news/bitcoin-rallies",
+        "keywords": ["bitcoin", "crypto", "markets"],
+        "creator": ["Reporter"],
+        "video_url": None,
+        "description": "Bitcoin rose on Wednesday after the central bank held rates steady. " * 3,
+        "content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 60,
+        "pubDate": "2023-03-01 12:00:00",
+        "image_url": None,
+        "source_id": "example",
+        "category": ["business"],
+        "country": ["united states of america"],
+        "language": "english",
+    }
+    return {"status": "success", "totalResults": n_articles, "results": [article] * n_articles, "nextPage": None}
+
+
+def make_handler(raw, compressed):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out in separate writes; without this, delayed ACKs add ~40ms
+        # to every keep-alive response, which no production server would show
+        disable_nagle_algorithm = True
+
+        def reply(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            gzip_ok = "gzip" in self.headers.get("Accept-Encoding", "")
+            body = compressed if gzip_ok else raw
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if gzip_ok:
+                self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = reply
+        do_POST = reply
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def measure(call, n):
+    latencies = []
+    for _ in range(n):
+        started = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--articles", type=int, default=50)
+    args = parser.parse_args()
+
+    raw = json.dumps(archive_page(args.articles)).encode()
+    compressed = gzip.compress(raw)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(raw, compressed))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/api/1/archive".format(server.server_address[1])
+
+    print("payload: {} KiB raw, {} KiB gzip, {} requests".format(len(raw) // 1024, len(compressed) // 1024, args.requests))
+    results = {"requests.get (connection per call)": measure(lambda: requests.get(url).json(), args.requests)}
+    for decoder in sorted(JSON_DECODERS):
+        client = HttpClient(json_decoder=decoder)
+        client.get_json(url)  # warm the pool
+        results["HttpClient pooled+gzip ({})".format(decoder)] = measure(lambda: client.get_json(url), args.requests)
+        client.close()
+
+    print("{:<36} {:>9} {:>9} {:>9}".format("client", "mean ms", "p50 ms", "p95 ms"))
+    for name, r in results.items():
+        print("{:<36} {:>9.3f} {:>9.3f} {:>9.3f}".format(name, r["mean"], r["p50"], r["p95"]))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+from news_windows import NewsWindows
+
+# Trailing-window news aggregation of the feature jobs: create_content (a boolean mask over all news and
+# a DataFrame mean per crypto timestamp) against NewsWindows (prefix sums and searchsorted), on a
+# synthetic history of crypto rates every 5 minutes and news spread over the days. create_content is
+# timed on --sample timestamps and extrapolated to the whole history; the results are compared on them.
+#
+#   python benchmarks/bench_news_windows.py --days 30 --news-per-day 150 --windows 6,24,72
+
+EMBD = ['EMBD{}'.format(i + 1) for i in range(768)]
+
+
+def create_content(t, df_news, news_hour_befor=24):
+    # what the feature jobs did per crypto timestamp
+    pt = news_hour_befor * 60 * 60 * 1000
+    return df_news[(df_news['TIMESTAMP'] < t) & (df_news['TIMESTAMP'] > t - pt)].mean()[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--news-per-day", type=int, default=150)
+    parser.add_argument("--sample", type=int, default=300)
+    parser.add_argument("--windows", default="6,24,72")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    start = 1677628800000
+    crypto_ts = start + np.arange(args.days * 24 * 12) * 5 * 60 * 1000
+    news_ts = np.sort(rng.integers(start, crypto_ts[-1], args.days * args.news_per_day))
+    embeddings = rng.standard_normal((len(news_ts), 768)).astype(np.float32)
+    df_news = pd.DataFrame(embeddings, columns=EMBD)
+    df_news.insert(0, 'TIMESTAMP', news_ts)
+    print("{} crypto timestamps, {} news articles".format(len(crypto_ts), len(news_ts)))
+
+    sample = crypto_ts[rng.choice(len(crypto_ts), min(args.sample, len(crypto_ts)), replace=False)]
+    started = time.perf_counter()
+    reference = pd.Series(sample).apply(lambda t: create_content(t, df_news, news_hour_befor=24)).values
+    old_seconds = (time.perf_counter() - started) * len(crypto_ts) / len(sample)
+
+    started = time.perf_counter()
+    windows = NewsWindows(news_ts, embeddings)
+    full = windows.mean(crypto_ts, 24)
+    new_seconds = time.perf_counter() - started
+    check = windows.mean(sample, 24)
+    agree = np.array_equal(np.isnan(reference), np.isnan(check))
+    diff = np.nanmax(np.abs(reference - check)) if agree else float('nan')
+
+    hours_list = [int(h) for h in args.windows.split(",")]
+    started = time.perf_counter()
+    windows = NewsWindows(news_ts, embeddings)
+    windows.means(crypto_ts, hours_list)
+    multi_seconds = time.perf_counter() - started
+
+    print("{:<34} {:>10}".format("path", "seconds"))
+    print("{:<34} {:>10.1f}".format("create_content, 24h (extrapolated)", old_seconds))
+    print("{:<34} {:>10.3f}".format("NewsWindows, 24h", new_seconds))
+    print("{:<34} {:>10.3f}".format("NewsWindows, {}h in one pass".format(args.windows), multi_seconds))
+    print("empty windows agree: {}, max |diff| on the sample: {:.2e}, rows: {}".format(agree, diff, len(full)))
+
+
+if __name__ == "__main__":
+    main()
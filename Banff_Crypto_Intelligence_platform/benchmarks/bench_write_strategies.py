@@ -0,0 +1,288 @@
+import argparse
+import datetime
+import random
+import sqlite3
+import time
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import oracledb
+except ImportError:
+    oracledb = None
+
+# Rows/sec of the ADW write strategies on real-shaped Crypto, News and FEATURES batches, against a
+# local stand-in (SQLite, or DuckDB when installed) or a real Oracle DSN:
+#
+#   row_merge      one MERGE FROM dual per row (OS2ADW before the staging path); NOT EXISTS insert elsewhere
+#   array_insert   plain executemany INSERT into an empty table: the ceiling, no duplicate handling
+#   staging_merge  array insert into a staging table, one set-based MERGE per batch (adw_load "staging")
+#   delete_insert  delete the batch keys from the table, then array insert the batch
+#
+# Table shapes follow the DDL of OS2ADW_history.py (Crypto, News) and ADW_Feature_Extraction_history.py
+# (FEATURES: the crypto columns, 768 embedding columns and TARGET). Before every run, overlap * rows
+# of the batch keys are preloaded so the dedupe paths have real duplicates to skip. The benchmark only
+# touches its own BENCH_* tables, also on Oracle. The local stand-ins run in-process, with no network
+# round trips, so they show the SQL-side cost of each strategy only; the round trips saved by array DML
+# only show against Oracle.
+#
+#   python benchmarks/bench_write_strategies.py --adapter sqlite --rows 20000 --batch-sizes 100,1000,10000
+#   python benchmarks/bench_write_strategies.py --adapter oracle --dsn banff_low --user ADMIN --password ... --config-dir ~/wallet
+
+# (column, type); the types are mapped per adapter
+TABLES = {
+    "crypto": {"columns": [("timestamp", "int"), ("rate", "float"), ("volume", "float"), ("cap", "float"),
+                           ("liquidity", "float")],
+               "keys": ["timestamp"], "primary_key": True},
+    "news": {"columns": [("pubDate", "date"), ("title", "text"), ("link", "text"), ("keywords", "text"),
+                         ("creator", "short"), ("video_url", "short"), ("description", "clob"), ("content", "clob"),
+                         ("image_url", "text"), ("source_id", "short"), ("category", "short"), ("country", "short"),
+                         ("language", "short")],
+             "keys": ["pubDate", "title"], "primary_key": False},
+    "features": {"columns": [("TIMESTAMP", "int"), ("RATE", "float"), ("VOLUME", "float"), ("CAP", "float"),
+                             ("LIQUIDITY", "float")] + [("EMBD{}".format(i + 1), "float") for i in range(768)]
+                            + [("TARGET", "short")],
+                 "keys": ["TIMESTAMP"], "primary_key": False},
+}
+
+STRATEGIES = ["row_merge", "array_insert", "staging_merge", "delete_insert"]
+
+
+def synthetic_rows(table, n):
+    start = datetime.datetime(2023, 3, 1)
+    rows = []
+    for i in range(n):
+        if table == "crypto":
+            rows.append((1677628800000 + i * 60000, 30000 + random.random() * 1000, float(random.randint(1, 10**10)),
+                         float(random.randint(1, 10**12)), random.random() * 10**8))
+        elif table == "news":
+            rows.append(((start + datetime.timedelta(seconds=i * 37)).strftime("%Y-%m-%d %H:%M:%S"),
+                         "Synthetic headline {}".format(i), "https://example.com/news/{}".format(i),
+                         "['bitcoin' 'crypto']", "['Reporter']", None, "Description " * 20, "Content " * 400,
+                         None, "example", "['business']", "['united states of america']", "english"))
+        else:
+            rows.append((1677628800000 + i * 60000, 30000 + random.random() * 1000, float(random.randint(1, 10**10)),
+                         float(random.randint(1, 10**12)), random.random() * 10**8)
+                        + tuple(random.uniform(-1, 1) for _ in range(768)) + (random.choice(["BUY", "SELL", "HOLD"]),))
+    return rows
+
+
+class Adapter:
+    # SQLite flavour; DuckDB and Oracle override what differs
+    name = "sqlite"
+    types = {"int": "INTEGER", "float": "REAL", "date": "TEXT", "text": "TEXT", "short": "TEXT", "clob": "TEXT"}
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def marker(self, i, kind):
+        return "?"
+
+    def execute(self, sql, params=None):
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params or [])
+        return cursor
+
+    def executemany(self, sql, rows, spec=None, row_merge=False):
+        self.connection.cursor().executemany(sql, rows)
+
+    def commit(self):
+        self.connection.commit()
+
+    def drop_table(self, name):
+        self.execute("DROP TABLE IF EXISTS {}".format(name))
+
+    def create_table(self, name, spec):
+        self.drop_table(name)
+        columns = ", ".join("{} {}".format(c, self.types[k]) for c, k in spec["columns"])
+        if spec["primary_key"]:
+            columns += ", PRIMARY KEY ({})".format(", ".join(spec["keys"]))
+        self.execute("CREATE TABLE {} ({})".format(name, columns))
+
+    def create_stage(self, name, spec):
+        self.execute("DROP TABLE IF EXISTS {}".format(name))
+        columns = ", ".join("{} {}".format(c, self.types[k]) for c, k in spec["columns"])
+        self.execute("CREATE TEMP TABLE {} ({})".format(name, columns))
+
+    def clear_stage(self, name):
+        self.execute("DELETE FROM {}".format(name))
+
+    def values(self, spec):
+        return ", ".join(self.marker(i + 1, k) for i, (_, k) in enumerate(spec["columns"]))
+
+    def insert_sql(self, name, spec):
+        return "INSERT INTO {} ({}) VALUES ({})".format(name, ", ".join(c for c, _ in spec["columns"]), self.values(spec))
+
+    def key_match(self, spec, left, right):
+        return " AND ".join("{}.{} = {}.{}".format(left, k, right, k) for k in spec["keys"])
+
+    def row_merge_sql(self, name, spec):
+        select = ", ".join("{} AS {}".format(self.marker(i + 1, k), c) for i, (c, k) in enumerate(spec["columns"]))
+        return "INSERT INTO {0} ({1}) SELECT {1} FROM (SELECT {2}) d WHERE NOT EXISTS (SELECT 1 FROM {0} t WHERE {3})".format(
+            name, ", ".join(c for c, _ in spec["columns"]), select, self.key_match(spec, "t", "d"))
+
+    def stage_merge_sql(self, name, stage, spec):
+        columns = ", ".join(c for c, _ in spec["columns"])
+        keys = ", ".join(spec["keys"])
+        return ("INSERT INTO {0} ({1}) SELECT {1} FROM (SELECT s.*, ROW_NUMBER() OVER (PARTITION BY {2} ORDER BY {2}) AS rn "
+                "FROM {3} s) d WHERE rn = 1 AND NOT EXISTS (SELECT 1 FROM {0} t WHERE {4})").format(
+            name, columns, keys, stage, self.key_match(spec, "t", "d"))
+
+    def delete_sql(self, name, spec):
+        kinds = dict(spec["columns"])
+        return "DELETE FROM {} WHERE {}".format(name, " AND ".join(
+            "{} = {}".format(k, self.marker(i + 1, kinds[k])) for i, k in enumerate(spec["keys"])))
+
+
+class DuckDBAdapter(Adapter):
+    name = "duckdb"
+    types = {"int": "BIGINT", "float": "DOUBLE", "date": "VARCHAR", "text": "VARCHAR", "short": "VARCHAR", "clob": "VARCHAR"}
+
+    def execute(self, sql, params=None):
+        return self.connection.execute(sql, params or [])
+
+    def executemany(self, sql, rows, spec=None, row_merge=False):
+        self.connection.executemany(sql, rows)
+
+
+class OracleAdapter(Adapter):
+    name = "oracle"
+    types = {"int": "NUMBER", "float": "NUMBER", "date": "DATE", "text": "VARCHAR2(4000)", "short": "VARCHAR2(256)",
+             "clob": "CLOB"}
+
+    def marker(self, i, kind):
+        if kind == "date":
+            return "TO_DATE(:{}, 'YYYY-MM-DD HH24:MI:SS')".format(i)
+        return ":{}".format(i)
+
+    def executemany(self, sql, rows, spec=None, row_merge=False):
+        cursor = self.connection.cursor()
+        if spec is not None:
+            # LONG binds stream large texts into a plain INSERT, but are refused in the SELECT ... FROM dual
+            # of the row MERGE (ORA-00997), which binds them as CLOB, as adw_load's NEWS_ROW_INPUT_SIZES
+            sizes = {"int": oracledb.DB_TYPE_NUMBER, "float": oracledb.DB_TYPE_NUMBER, "date": 19, "text": 4000,
+                     "short": 256, "clob": oracledb.DB_TYPE_CLOB if row_merge else oracledb.DB_TYPE_LONG}
+            cursor.setinputsizes(*[sizes[k] for _, k in spec["columns"]])
+        cursor.executemany(sql, rows)
+
+    def drop_table(self, name):
+        try:
+            self.execute("DROP TABLE {} PURGE".format(name))
+        except oracledb.DatabaseError:
+            pass
+
+    def create_stage(self, name, spec):
+        self.drop_table(name)
+        columns = ", ".join("{} {}".format(c, self.types[k]) for c, k in spec["columns"])
+        self.execute("CREATE GLOBAL TEMPORARY TABLE {} ({}) ON COMMIT DELETE ROWS".format(name, columns))
+
+    def clear_stage(self, name):
+        pass  # emptied by the commit
+
+    def row_merge_sql(self, name, spec):
+        select = ", ".join("{} AS {}".format(self.marker(i + 1, k), c) for i, (c, k) in enumerate(spec["columns"]))
+        return self._merge(name, "(SELECT {} FROM dual)".format(select), spec)
+
+    def stage_merge_sql(self, name, stage, spec):
+        keys = ", ".join(spec["keys"])
+        source = "(SELECT * FROM (SELECT s.*, ROW_NUMBER() OVER (PARTITION BY {0} ORDER BY ROWNUM) AS rn FROM {1} s) WHERE rn = 1)".format(keys, stage)
+        return self._merge(name, source, spec)
+
+    def _merge(self, name, source, spec):
+        columns = [c for c, _ in spec["columns"]]
+        return "MERGE INTO {} t USING {} d ON ({}) WHEN NOT MATCHED THEN INSERT ({}) VALUES ({})".format(
+            name, source, self.key_match(spec, "t", "d"), ", ".join(columns), ", ".join("d." + c for c in columns))
+
+
+def batches(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def run(adapter, table, strategy, rows, batch_size, overlap):
+    spec = TABLES[table]
+    name, stage = "BENCH_" + table.upper(), "BENCH_" + table.upper() + "_STAGE"
+    adapter.create_table(name, spec)
+    if strategy != "array_insert":
+        # the rows of an earlier, overlapping ingest window
+        preload = random.sample(rows, int(len(rows) * overlap))
+        for batch in batches(preload, 1000):
+            adapter.executemany(adapter.insert_sql(name, spec), batch, spec)
+        adapter.commit()
+    if strategy == "staging_merge":
+        adapter.create_stage(stage, spec)
+
+    started = time.perf_counter()
+    for batch in batches(rows, batch_size):
+        if strategy == "row_merge":
+            adapter.executemany(adapter.row_merge_sql(name, spec), batch, spec, row_merge=True)
+        elif strategy == "array_insert":
+            adapter.executemany(adapter.insert_sql(name, spec), batch, spec)
+        elif strategy == "staging_merge":
+            adapter.executemany(adapter.insert_sql(stage, spec), batch, spec)
+            adapter.execute(adapter.stage_merge_sql(name, stage, spec))
+            adapter.clear_stage(stage)
+        else:
+            positions = [[c for c, _ in spec["columns"]].index(k) for k in spec["keys"]]
+            adapter.executemany(adapter.delete_sql(name, spec), [tuple(row[p] for p in positions) for row in batch])
+            adapter.executemany(adapter.insert_sql(name, spec), batch, spec)
+        adapter.commit()
+    elapsed = time.perf_counter() - started
+
+    loaded = adapter.execute("SELECT COUNT(*) FROM {}".format(name)).fetchone()[0]
+    adapter.drop_table(name)
+    if strategy == "staging_merge":
+        adapter.drop_table(stage)
+    adapter.commit()
+    return elapsed, loaded
+
+
+def connect(args):
+    if args.adapter == "sqlite":
+        return Adapter(sqlite3.connect(args.sqlite_path))
+    if args.adapter == "duckdb":
+        if duckdb is None:
+            raise SystemExit("duckdb is not installed")
+        return DuckDBAdapter(duckdb.connect(args.duckdb_path))
+    if oracledb is None:
+        raise SystemExit("oracledb is not installed")
+    return OracleAdapter(oracledb.connect(user=args.user, password=args.password, dsn=args.dsn,
+                                          config_dir=args.config_dir, wallet_location=args.config_dir,
+                                          wallet_password=args.wallet_password))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--adapter", choices=["sqlite", "duckdb", "oracle"], default="sqlite")
+    parser.add_argument("--tables", default="crypto,news,features")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES))
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--batch-sizes", default="100,1000,10000")
+    parser.add_argument("--overlap", type=float, default=0.3)
+    parser.add_argument("--sqlite-path", default=":memory:")
+    parser.add_argument("--duckdb-path", default=":memory:")
+    parser.add_argument("--dsn")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--config-dir")
+    parser.add_argument("--wallet-password")
+    args = parser.parse_args()
+
+    adapter = connect(args)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    print("{:<8} {:<10} {:<14} {:>7} {:>8} {:>9} {:>12}".format("adapter", "table", "strategy", "batch", "rows", "seconds", "rows/s"))
+    for table in args.tables.split(","):
+        rows = synthetic_rows(table, args.rows)
+        for strategy in args.strategies.split(","):
+            for batch_size in batch_sizes:
+                elapsed, loaded = run(adapter, table, strategy, rows, batch_size, args.overlap)
+                assert loaded == len(rows), (table, strategy, loaded)
+                print("{:<8} {:<10} {:<14} {:>7} {:>8} {:>9.2f} {:>12.0f}".format(
+                    adapter.name, table, strategy, batch_size, len(rows), elapsed, len(rows) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import contextlib
+import hashlib
+import json
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications'))
+import OS2ADW_event
+from OS2ADW_event import Local_Data_Store, handle_event, parse_event, source_of
+from OS2ADW import SOURCES, load_settings
+from adw_load import RunSummary
+
+# Replays the sample Object Storage event against a Local_Data_Store; the database is a stand-in pool
+# whose ledger is a dict, whose claims held by other sessions are a set, and whose loads are recorded
+# instead of sent.
+#
+#   python -m pytest tests
+
+EVENT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'objectstorage_createobject_event.json')
+ADW_ENV = {'CW_ingest_path': 'data-lake/raw-data/crypto', 'ND_ingest_path': 'data-lake/raw-data/news'}
+
+
+class FakePool:
+    # acquire() hands out the same stand-in connection; the ledger and the loads live on the pool
+    def __init__(self, ledger=None, rejected_dates=(), claimed_elsewhere=()):
+        self.ledger = dict(ledger or {})
+        self.claimed_elsewhere = set(claimed_elsewhere)
+        self.rejected_dates = set(rejected_dates)
+        self.loads = []
+
+    @contextlib.contextmanager
+    def acquire(self):
+        yield self
+
+    def rollback(self):
+        pass
+
+    def load(self, connection, table, load_mode, chunk_rows):
+        self.loads.append(table)
+        rejected = [(offset, dict(row, error='ORA-01400')) for offset, row in enumerate(table.to_pylist())
+                    if row['date'] in self.rejected_dates]
+        chunk = {'rows': table.num_rows, 'inserted': table.num_rows - len(rejected), 'rejected': len(rejected),
+                 'duplicates': 0}
+        return [chunk], rejected
+
+
+@pytest.fixture
+def event():
+    with open(EVENT_FILE) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def store(tmp_path, event):
+    # the object named in the event, three crypto rows
+    store = Local_Data_Store(str(tmp_path))
+    table = pa.table({'date': [1677628800000, 1677629100000, 1677629400000], 'rate': [23000.0, 23010.0, 23020.0],
+                      'volume': [1e9] * 3, 'cap': [4e11] * 3, 'liquidity': [1e8] * 3})
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    store.create_object(sink.getvalue().to_pybytes(), event['data']['resourceName'])
+    return store
+
+
+def run(event, store, pool, monkeypatch):
+    monkeypatch.setitem(SOURCES['crypto'], 'load', pool.load)
+    monkeypatch.setattr(OS2ADW_event, 'claim_objects',
+                        lambda connection, source, names: set(names) - connection.claimed_elsewhere)
+    monkeypatch.setattr(OS2ADW_event, 'loaded_etag', lambda connection, name: connection.ledger.get(name))
+    monkeypatch.setattr(OS2ADW_event, 'record_loaded', lambda connection, source, loaded: connection.ledger.update(
+        {obj.name: obj.etag for obj, _ in loaded}))
+    settings = load_settings(ADW_ENV, lambda: store)
+    summary = RunSummary()
+    loaded = handle_event(event, store, pool, settings, summary)
+    assert not summary.failed()
+    return loaded
+
+
+def test_parse_event(event):
+    object_name, etag = parse_event(event)
+    assert object_name.endswith('/rc1677650000_1677628800_1677650400.parquet')
+    assert etag == '0b5d7b2f-8e1c-4a50-9d8d-3c2f5e6a7b10'
+    assert parse_event({'data': {'resourceName': 'a.parquet'}}) == ('a.parquet', None)
+
+
+def test_source_of():
+    assert source_of('data-lake/raw-data/crypto/year=2023/rc1_2_3.parquet', ADW_ENV) == 'crypto'
+    assert source_of('data-lake/raw-data/news/year=2023/rn1_2_3.parquet', ADW_ENV) == 'news'
+    assert source_of('data-lake/raw-data/crypto-old/rc1_2_3.parquet', ADW_ENV) is None
+
+
+def test_handle_event_loads_and_records(event, store, monkeypatch):
+    pool = FakePool()
+    assert run(event, store, pool, monkeypatch) == 3
+    object_name = event['data']['resourceName']
+    assert [table.num_rows for table in pool.loads] == [3]
+    # the ETag recorded is the one of the content loaded, not the one in the event
+    assert pool.ledger == {object_name: hashlib.md5(store.get_object(object_name).data.content).hexdigest()}
+
+
+def test_handle_event_skips_redelivery(event, store, monkeypatch):
+    object_name, etag = parse_event(event)
+    pool = FakePool(ledger={object_name: etag})
+    assert run(event, store, pool, monkeypatch) == 0
+    assert pool.loads == []
+
+
+def test_handle_event_skips_objects_claimed_by_another_run(event, store, monkeypatch):
+    # a redelivery handled at the same time, or the hourly run, is loading the object
+    pool = FakePool(claimed_elsewhere=[event['data']['resourceName']])
+    assert run(event, store, pool, monkeypatch) == 0
+    assert pool.loads == [] and pool.ledger == {}
+
+
+def test_handle_event_skips_other_objects(event, store, monkeypatch):
+    event['data']['resourceName'] = 'data-lake/raw-data/crypto/.compaction.json'
+    pool = FakePool()
+    assert run(event, store, pool, monkeypatch) == 0
+    assert pool.loads == [] and pool.ledger == {}
+
+
+def test_handle_event_quarantines_rejected_rows(event, store, monkeypatch, tmp_path):
+    pool = FakePool(rejected_dates=[1677629100000])
+    assert run(event, store, pool, monkeypatch) == 2
+    quarantined = list((tmp_path / 'data-lake' / 'raw-data' / '_quarantine' / 'crypto').iterdir())
+    assert len(quarantined) == 1
+    rows = [json.loads(line) for line in quarantined[0].read_text().splitlines()]
+    assert [row['date'] for row in rows] == [1677629100000]
+    # the object still counts as loaded; its rejected row is kept in quarantine
+    assert event['data']['resourceName'] in pool.ledger